@@ -1,8 +1,10 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from beanie import init_beanie
 import os
+from typing import Optional
 from dotenv import load_dotenv
 from models import UserProgress
+from migrations import user_id_index_needs_migration
 import logging
 
 load_dotenv()
@@ -17,14 +19,45 @@ logging.basicConfig(
 )
 
 
+_client: Optional[AsyncIOMotorClient] = None
+
+
+def get_client() -> AsyncIOMotorClient:
+    """Return the shared MongoDB client, creating it on first use"""
+    global _client
+    if _client is None:
+        _client = AsyncIOMotorClient(
+            os.getenv("MONGODB_URI", "mongodb://localhost:27017"),
+            maxPoolSize=200,
+            minPoolSize=10,
+            maxIdleTimeMS=300_000,
+            serverSelectionTimeoutMS=5000
+        )
+    return _client
+
+
 async def init_db():
     logger = logging.getLogger('devquest.database')
     try:
-        client = AsyncIOMotorClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017"))
+        client = get_client()
         db = client[os.getenv("DB_NAME")]
         logger.info(f"Connecting to MongoDB database: {os.getenv('DB_NAME')}")
+        if await user_id_index_needs_migration(db):
+            # init_beanie would fail with IndexOptionsConflict on the old index
+            raise RuntimeError(
+                "user_progress has a non-unique user_id_1 index; "
+                "run `python migrations.py` before starting the service"
+            )
         await init_beanie(database=db, document_models=[UserProgress])
         logger.info("Successfully initialized Beanie with MongoDB")
     except Exception as e:
         logger.error(f"Failed to initialize database: {str(e)}")
         raise
+
+
+def close_db():
+    """Close the shared MongoDB client"""
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
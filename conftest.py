@@ -1,4 +1,5 @@
 import pytest
+import pytest_asyncio
 import asyncio
 import motor.motor_asyncio
 from beanie import init_beanie
@@ -11,7 +12,7 @@ def event_loop():
     yield loop
     loop.close()
 
-@pytest.fixture(scope="session")
+@pytest_asyncio.fixture(scope="session")
 async def mongodb():
     """Create a MongoDB test database."""
     client = motor.motor_asyncio.AsyncIOMotorClient(
@@ -31,9 +32,9 @@ async def mongodb():
     await db.user_progress.delete_many({})  # Changed from drop to delete_many
     client.close()
 
-@pytest.fixture(autouse=True)
+@pytest_asyncio.fixture(autouse=True)
 async def clean_db(mongodb):
     """Clean the UserProgress collection before each test."""
+    # Beanie is initialized once by the session-scoped mongodb fixture
     await mongodb.user_progress.delete_many({})  # Changed from drop to delete_many
-    await init_beanie(database=mongodb, document_models=[UserProgress])
     yield
\ No newline at end of file
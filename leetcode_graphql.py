@@ -1,17 +1,234 @@
 # leetcode_graphql.py
 import httpx
 import logging
-from typing import Dict, Optional, List, Tuple
+from typing import Dict, Optional, List, Set, Tuple
 from datetime import datetime, timezone
+from collections import defaultdict
 from models import CalendarStats, CalendarStreak, Badge
-import json
+import orjson
 import asyncio
+import contextlib
+import hashlib
+import time
 
 logger = logging.getLogger('devquest.leetcode.graphql')
 
+# Responses younger than this are served straight from the cache
+GRAPHQL_CACHE_TTL = 60
+# Older responses, up to this age, are served while a refresh runs in the background
+GRAPHQL_CACHE_MAX_STALE = 300
+GRAPHQL_CACHE_MAX_ENTRIES = 1024
+
+# Query name, every query variable, and a fingerprint of the caller's credentials
+_CacheKey = Tuple[str, Tuple[Tuple[str, object], ...], bytes]
+
 class LeetCodeGraphQLService:
-    def __init__(self):
+    _BASE_HEADERS = {
+        "Content-Type": "application/json",
+        "Referer": "https://leetcode.com"
+    }
+
+    # matchedUser selections, shared by the single-purpose queries and the
+    # batched query in fetch_all_stats so the two can't drift apart
+    _TAG_STATS_FIELDS = """
+        tagProblemCounts {
+          advanced { tagName tagSlug problemsSolved }
+          intermediate { tagName tagSlug problemsSolved }
+          fundamental { tagName tagSlug problemsSolved }
+        }"""
+
+    _CALENDAR_FIELDS = """
+        userCalendar(year: $year) {
+          activeYears
+          streak
+          totalActiveDays
+          dccBadges {
+            timestamp
+            badge { name icon }
+          }
+          submissionCalendar
+        }"""
+
+    _LANGUAGE_STATS_FIELDS = """
+        languageProblemCount {
+          languageName
+          problemsSolved
+        }"""
+
+    _PROBLEM_STATS_FIELDS = """
+        problemsSolvedBeatsStats {
+          difficulty
+          percentage
+        }
+        submitStatsGlobal {
+          acSubmissionNum {
+            difficulty
+            count
+          }
+        }"""
+
+    _BADGE_FIELDS = """
+        activeBadge {
+          displayName
+          icon
+        }"""
+
+    _ALL_QUESTIONS_COUNT_FIELDS = """
+      allQuestionsCount {
+        difficulty
+        count
+      }"""
+
+    _TAG_STATS_QUERY = f"""
+    query skillStats($username: String!) {{
+      matchedUser(username: $username) {{{_TAG_STATS_FIELDS}
+      }}
+    }}
+    """
+
+    _CALENDAR_QUERY = f"""
+    query userProfileCalendar($username: String!, $year: Int) {{
+      matchedUser(username: $username) {{{_CALENDAR_FIELDS}
+      }}
+    }}
+    """
+
+    _LANGUAGE_STATS_QUERY = f"""
+    query languageStats($username: String!) {{
+      matchedUser(username: $username) {{{_LANGUAGE_STATS_FIELDS}
+      }}
+    }}
+    """
+
+    _PROBLEM_STATS_QUERY = f"""
+    query userProblemsSolved($username: String!) {{{_ALL_QUESTIONS_COUNT_FIELDS}
+      matchedUser(username: $username) {{{_PROBLEM_STATS_FIELDS}
+      }}
+    }}
+    """
+
+    _BADGE_QUERY = f"""
+    query getUserProfile($username: String!) {{
+      matchedUser(username: $username) {{{_BADGE_FIELDS}
+      }}
+    }}
+    """
+
+    _ALL_STATS_QUERY = f"""
+    query allStats($username: String!, $year: Int) {{{_ALL_QUESTIONS_COUNT_FIELDS}
+      matchedUser(username: $username) {{{_TAG_STATS_FIELDS}{_LANGUAGE_STATS_FIELDS}{_PROBLEM_STATS_FIELDS}{_CALENDAR_FIELDS}{_BADGE_FIELDS}
+      }}
+    }}
+    """
+
+    def __init__(self, semaphore: Optional[asyncio.Semaphore] = None):
         self.graphql_url = "https://leetcode.com/graphql/"
+        # Shared HTTP/2 client so concurrent queries multiplex over one connection
+        self._client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            timeout=10.0
+        )
+        # Cache key -> (fetched at, response data)
+        self._cache: Dict[_CacheKey, Tuple[float, Dict]] = {}
+        self._refreshing: Set[_CacheKey] = set()
+        self._background_tasks: Set[asyncio.Task] = set()
+        # Optional cap on in-flight requests, shared with other LeetCode clients
+        self._semaphore = semaphore
+
+    @classmethod
+    def _build_headers(cls, csrf_token: str, cookie: str) -> Dict[str, str]:
+        return {**cls._BASE_HEADERS, "x-csrftoken": csrf_token, "Cookie": cookie}
+
+    @staticmethod
+    def _matched_user(data: Optional[Dict]) -> Dict:
+        """Return the matchedUser object of a response, or an empty dict"""
+        return (data or {}).get("matchedUser") or {}
+
+    @staticmethod
+    def _longest_streak(active_days: List[int]) -> int:
+        """Longest run of consecutive days, given days as integers since the epoch"""
+        longest = run = 0
+        previous_day = None
+        for day in sorted(active_days):
+            run = run + 1 if previous_day is not None and day == previous_day + 1 else 1
+            previous_day = day
+            if run > longest:
+                longest = run
+        return longest
+
+    async def aclose(self) -> None:
+        """Close the underlying HTTP client"""
+        for task in self._background_tasks:
+            task.cancel()
+        await self._client.aclose()
+
+    @staticmethod
+    def _cache_key(name: str, variables: Dict, headers: Dict) -> _CacheKey:
+        credentials = f"{headers.get('x-csrftoken', '')}\0{headers.get('Cookie', '')}"
+        return (
+            name,
+            tuple(sorted(variables.items())),
+            hashlib.blake2b(credentials.encode(), digest_size=16).digest()
+        )
+
+    def _store_cached(self, key: _CacheKey, data: Dict) -> None:
+        self._cache.pop(key, None)
+        if len(self._cache) >= GRAPHQL_CACHE_MAX_ENTRIES:
+            # Entries are kept in insertion order, so the first is the oldest
+            del self._cache[next(iter(self._cache))]
+        self._cache[key] = (time.monotonic(), data)
+
+    async def _refresh_cached(
+        self,
+        key: _CacheKey,
+        query: str,
+        variables: Dict,
+        headers: Dict
+    ) -> None:
+        try:
+            data = await self._make_graphql_request(query, variables, headers)
+            if data is not None:
+                self._store_cached(key, data)
+        finally:
+            self._refreshing.discard(key)
+
+    async def _cached_graphql_request(
+        self,
+        name: str,
+        query: str,
+        variables: Dict,
+        headers: Dict,
+        use_cache: bool = True
+    ) -> Optional[Dict]:
+        """Serve a GraphQL response from cache, revalidating it in the background once stale
+
+        With use_cache=False the cache is bypassed entirely: the response is
+        fetched fresh and not stored.
+        """
+        if not use_cache:
+            return await self._make_graphql_request(query, variables, headers)
+        key = self._cache_key(name, variables, headers)
+        entry = self._cache.get(key)
+        if entry is not None:
+            fetched_at, data = entry
+            age = time.monotonic() - fetched_at
+            if age < GRAPHQL_CACHE_TTL:
+                return data
+            if age < GRAPHQL_CACHE_MAX_STALE:
+                if key not in self._refreshing:
+                    self._refreshing.add(key)
+                    task = asyncio.create_task(
+                        self._refresh_cached(key, query, variables, headers)
+                    )
+                    self._background_tasks.add(task)
+                    task.add_done_callback(self._background_tasks.discard)
+                return data
+
+        data = await self._make_graphql_request(query, variables, headers)
+        if data is not None:
+            self._store_cached(key, data)
+        return data
 
     async def _make_graphql_request(
         self,
@@ -20,8 +237,8 @@ class LeetCodeGraphQLService:
         headers: Dict
     ) -> Optional[Dict]:
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
+            async with self._semaphore or contextlib.nullcontext():
+                response = await self._client.post(
                     self.graphql_url,
                     json={
                         "query": query,
@@ -29,14 +246,15 @@ class LeetCodeGraphQLService:
                     },
                     headers=headers
                 )
-                response.raise_for_status()
-                data = response.json()
+            response.raise_for_status()
+            logger.debug("GraphQL response over %s", response.http_version)
+            data = orjson.loads(response.content)
+            
+            if "errors" in data:
+                logger.error(f"GraphQL errors: {data['errors']}")
+                return None
                 
-                if "errors" in data:
-                    logger.error(f"GraphQL errors: {data['errors']}")
-                    return None
-                    
-                return data.get("data", {})
+            return data.get("data", {})
         except Exception as e:
             logger.error(f"GraphQL request failed: {str(e)}", exc_info=True)
             return None
@@ -48,27 +266,9 @@ class LeetCodeGraphQLService:
         cookie: str
     ) -> Optional[Dict]:
         """Fetch user's tag statistics"""
-        query = """
-        query skillStats($username: String!) {
-          matchedUser(username: $username) {
-            tagProblemCounts {
-              advanced { tagName tagSlug problemsSolved }
-              intermediate { tagName tagSlug problemsSolved }
-              fundamental { tagName tagSlug problemsSolved }
-            }
-          }
-        }
-        """
-        
-        headers = {
-            "Content-Type": "application/json",
-            "x-csrftoken": csrf_token,
-            "Cookie": cookie,
-            "Referer": "https://leetcode.com"
-        }
-        
-        data = await self._make_graphql_request(query, {"username": username}, headers)
-        return data.get("matchedUser", {}).get("tagProblemCounts", {})
+        headers = self._build_headers(csrf_token, cookie)
+        data = await self._cached_graphql_request("tag_stats", self._TAG_STATS_QUERY, {"username": username}, headers)
+        return self._matched_user(data).get("tagProblemCounts") or {}
 
     async def fetch_calendar_stats(
         self,
@@ -77,37 +277,14 @@ class LeetCodeGraphQLService:
         cookie: str
     ) -> Optional[Dict]:
         """Fetch user's submission calendar"""
-        query = """
-        query userProfileCalendar($username: String!, $year: Int) {
-          matchedUser(username: $username) {
-            userCalendar(year: $year) {
-              activeYears
-              streak
-              totalActiveDays
-              dccBadges {
-                timestamp
-                badge { name icon }
-              }
-              submissionCalendar
-            }
-          }
-        }
-        """
-        
-        headers = {
-            "Content-Type": "application/json",
-            "x-csrftoken": csrf_token,
-            "Cookie": cookie,
-            "Referer": "https://leetcode.com"
-        }
-        
+        headers = self._build_headers(csrf_token, cookie)
         current_year = datetime.now().year
-        data = await self._make_graphql_request(query, {
+        data = await self._cached_graphql_request("calendar", self._CALENDAR_QUERY, {
             "username": username,
             "year": current_year
         }, headers)
         
-        return data.get("matchedUser", {}).get("userCalendar", {})
+        return self._matched_user(data).get("userCalendar") or {}
 
     def process_calendar_data(self, calendar_data: Dict) -> CalendarStats:
         """Process raw calendar data into structured format"""
@@ -115,48 +292,55 @@ class LeetCodeGraphQLService:
             return CalendarStats()
 
         # Parse submission calendar
-        submissions_calendar = json.loads(
-            calendar_data.get("submissionCalendar", "{}")
+        submissions_calendar = orjson.loads(
+            calendar_data.get("submissionCalendar") or "{}"
         )
 
         # Convert Unix timestamps to YYYY-MM-DD format and organize data
         submissions_by_date = {}
-        monthly_submissions = {}
-        yearly_submissions = {}
+        monthly_submissions = defaultdict(int)
+        yearly_submissions = defaultdict(int)
+        active_days = []
 
+        # Month and year buckets are keyed by integers and only formatted
+        # once per bucket after the loop
         for timestamp_str, count in submissions_calendar.items():
-            # Convert timestamp to datetime
             timestamp = int(timestamp_str)
-            date = datetime.fromtimestamp(timestamp, tz=timezone.utc)
-            
-            # Store daily data
-            date_str = date.strftime("%Y-%m-%d")
-            submissions_by_date[date_str] = count
-            
-            # Update monthly aggregates
-            month_key = date.strftime("%Y-%m")
-            monthly_submissions[month_key] = (
-                monthly_submissions.get(month_key, 0) + count
-            )
-            
-            # Update yearly aggregates
-            year_key = date.strftime("%Y")
-            yearly_submissions[year_key] = (
-                yearly_submissions.get(year_key, 0) + count
-            )
+            year, month, day = time.gmtime(timestamp)[:3]
+            submissions_by_date[f"{year:04d}-{month:02d}-{day:02d}"] = count
+            monthly_submissions[year, month] += count
+            yearly_submissions[year] += count
+            if count:
+                active_days.append(timestamp // 86400)
 
-        return CalendarStats(
-            active_years=calendar_data.get("activeYears", []),
-            total_active_days=calendar_data.get("totalActiveDays", 0),
-            streak=calendar_data.get("streak", 0),
-            submissions_by_date=submissions_by_date,
-            monthly_submissions=monthly_submissions,
-            yearly_submissions=yearly_submissions,
-            streaks=CalendarStreak(
-                current=calendar_data.get("streak", 0),
-                longest=calendar_data.get("streak", 0)  # You might want to calculate this separately
+        # Scalars come straight from LeetCode, so validate them; fields that
+        # are missing or null fall back to the model defaults
+        calendar_stats = CalendarStats.model_validate({
+            field: calendar_data[key]
+            for key, field in (
+                ("activeYears", "active_years"),
+                ("totalActiveDays", "total_active_days"),
+                ("streak", "streak")
             )
+            if calendar_data.get(key) is not None
+        })
+        calendar_stats.streaks = CalendarStreak(
+            current=calendar_stats.streak,
+            # The calendar may not reach back to the start of the current streak
+            longest=max(self._longest_streak(active_days), calendar_stats.streak)
         )
+        # The per-day dict and its totals were built above, so skip
+        # validating their potentially thousands of entries again
+        calendar_stats.submissions_by_date = submissions_by_date
+        calendar_stats.monthly_submissions = {
+            f"{year:04d}-{month:02d}": count
+            for (year, month), count in monthly_submissions.items()
+        }
+        calendar_stats.yearly_submissions = {
+            f"{year:04d}": count
+            for year, count in yearly_submissions.items()
+        }
+        return calendar_stats
 
 
     async def fetch_language_stats(
@@ -166,26 +350,9 @@ class LeetCodeGraphQLService:
         cookie: str
     ) -> Optional[List[Dict]]:
         """Fetch user's language statistics"""
-        query = """
-        query languageStats($username: String!) {
-          matchedUser(username: $username) {
-            languageProblemCount {
-              languageName
-              problemsSolved
-            }
-          }
-        }
-        """
-        
-        headers = {
-            "Content-Type": "application/json",
-            "x-csrftoken": csrf_token,
-            "Cookie": cookie,
-            "Referer": "https://leetcode.com"
-        }
-        
-        data = await self._make_graphql_request(query, {"username": username}, headers)
-        return data.get("matchedUser", {}).get("languageProblemCount", [])
+        headers = self._build_headers(csrf_token, cookie)
+        data = await self._cached_graphql_request("language_stats", self._LANGUAGE_STATS_QUERY, {"username": username}, headers)
+        return self._matched_user(data).get("languageProblemCount") or []
 
     async def fetch_problem_stats(
         self,
@@ -194,35 +361,8 @@ class LeetCodeGraphQLService:
         cookie: str
     ) -> Optional[Dict]:
         """Fetch user's problem solving statistics"""
-        query = """
-        query userProblemsSolved($username: String!) {
-          allQuestionsCount {
-            difficulty
-            count
-          }
-          matchedUser(username: $username) {
-            problemsSolvedBeatsStats {
-              difficulty
-              percentage
-            }
-            submitStatsGlobal {
-              acSubmissionNum {
-                difficulty
-                count
-              }
-            }
-          }
-        }
-        """
-        
-        headers = {
-            "Content-Type": "application/json",
-            "x-csrftoken": csrf_token,
-            "Cookie": cookie,
-            "Referer": "https://leetcode.com"
-        }
-        
-        return await self._make_graphql_request(query, {"username": username}, headers)
+        headers = self._build_headers(csrf_token, cookie)
+        return await self._cached_graphql_request("problem_stats", self._PROBLEM_STATS_QUERY, {"username": username}, headers)
     
     async def fetch_user_badges(
         self,
@@ -231,26 +371,9 @@ class LeetCodeGraphQLService:
         cookie: str
     ) -> Optional[Dict]:
         """Fetch user's active badge"""
-        query = """
-        query getUserProfile($username: String!) {
-          matchedUser(username: $username) {
-            activeBadge {
-              displayName
-              icon
-            }
-          }
-        }
-        """
-        
-        headers = {
-            "Content-Type": "application/json",
-            "x-csrftoken": csrf_token,
-            "Cookie": cookie,
-            "Referer": "https://leetcode.com"
-        }
-        
-        data = await self._make_graphql_request(query, {"username": username}, headers)
-        return data.get("matchedUser", {}).get("activeBadge") if data else None
+        headers = self._build_headers(csrf_token, cookie)
+        data = await self._cached_graphql_request("badges", self._BADGE_QUERY, {"username": username}, headers)
+        return self._matched_user(data).get("activeBadge")
 
     def process_badge_data(self, badge_data: Optional[Dict]) -> List[Badge]:
         """Process badge data into structured format"""
@@ -266,25 +389,37 @@ class LeetCodeGraphQLService:
         self,
         username: str,
         csrf_token: str,
-        cookie: str
+        cookie: str,
+        use_cache: bool = True
     ) -> Tuple[Optional[Dict], Optional[List[Dict]], Optional[Dict], Optional[Dict], Optional[Dict]]:
-        """Fetch all statistics in parallel"""
-        tag_stats_task = self.fetch_user_tag_stats(username, csrf_token, cookie)
-        language_stats_task = self.fetch_language_stats(username, csrf_token, cookie)
-        problem_stats_task = self.fetch_problem_stats(username, csrf_token, cookie)
-        calendar_stats_task = self.fetch_calendar_stats(username, csrf_token, cookie)
-        badge_stats_task = self.fetch_user_badges(username, csrf_token, cookie)
+        """Fetch all statistics with a single batched GraphQL query
+
+        Pass use_cache=False when the result is persisted, so a sync never
+        saves stats up to GRAPHQL_CACHE_MAX_STALE seconds old, nor fills the
+        cache with per-user payloads nothing reads back.
+        """
+        headers = self._build_headers(csrf_token, cookie)
+        data = await self._cached_graphql_request("all_stats", self._ALL_STATS_QUERY, {
+            "username": username,
+            "year": datetime.now().year
+        }, headers, use_cache=use_cache)
+        if not data:
+            return None, None, None, None, None
         
-        results = await asyncio.gather(
-            tag_stats_task,
-            language_stats_task,
-            problem_stats_task,
-            calendar_stats_task,
-            badge_stats_task,
-            return_exceptions=True
-        )
+        # Split the combined response back into the per-query shapes
+        matched_user = self._matched_user(data)
+        problem_stats = {
+            "allQuestionsCount": data.get("allQuestionsCount", []),
+            "matchedUser": {
+                "problemsSolvedBeatsStats": matched_user.get("problemsSolvedBeatsStats", []),
+                "submitStatsGlobal": matched_user.get("submitStatsGlobal", {})
+            }
+        }
         
-        return tuple(
-            None if isinstance(result, Exception) else result
-            for result in results
+        return (
+            matched_user.get("tagProblemCounts", {}),
+            matched_user.get("languageProblemCount", []),
+            problem_stats,
+            matched_user.get("userCalendar", {}),
+            matched_user.get("activeBadge")
         )
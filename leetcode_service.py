@@ -1,21 +1,38 @@
-from typing import Optional, Dict, List, Tuple
+from typing import Optional, Dict, List, Set, Tuple
 import httpx
 import asyncio
-from datetime import datetime, timedelta
+import bisect
+import functools
+import itertools
+from datetime import date, datetime, timezone
 from tester import setup_logging
-from models import UserProgress, Question, PlatformProgress, AggregatedStats, ProgressData, TagStats, TagStat, ProblemCounts, LanguageStat
+from models import UserProgress, UserStatsView, Question, PlatformProgress, AggregatedStats, ProgressData, TagStats, TagStat, ProblemCounts, LanguageStat
 from leetcode_graphql import LeetCodeGraphQLService
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 import backoff
+import orjson
 import logging
-from redis_service import RedisService
-import os
-from urllib.parse import unquote
+from redis_service import REDIS_URL, RedisService
 
 # logging.basicConfig(level=logging.INFO)
 # logger = logging.getLogger(__name__)
 logger = setup_logging()
 
+SUBMISSIONS_PAGE_SIZE = 20
+# Number of submission pages requested concurrently after the first one
+SUBMISSIONS_PREFETCH_PAGES = 5
+# Upper bound on concurrent requests to LeetCode per sync
+LEETCODE_MAX_CONCURRENT_REQUESTS = 10
+
+TAG_CATEGORIES = ("advanced", "intermediate", "fundamental")
+
+_UTC = timezone.utc
+
+# Upper submission counts of heatmap intensities 0-3; anything above is 4
+_INTENSITY_THRESHOLDS = (0, 3, 6, 10)
+
 class LeetCodeSubmission(BaseModel):
     id: int
     question_id: int
@@ -27,33 +44,96 @@ class LeetCodeSubmission(BaseModel):
     memory: str
     lang: str
 
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the process-wide LeetCode HTTP client, creating it on first use"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=100,
+                max_keepalive_connections=20,
+                keepalive_expiry=300
+            ),
+            timeout=httpx.Timeout(30.0)
+        )
+    return _http_client
+
+async def close_http_client() -> None:
+    """Close the process-wide LeetCode HTTP client"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+def _is_permanent_error(e: Exception) -> bool:
+    """Client errors other than rate limiting will not succeed on retry"""
+    return (
+        isinstance(e, httpx.HTTPStatusError)
+        and e.response.status_code < 500
+        and e.response.status_code != 429
+    )
+
+@backoff.on_exception(
+    backoff.expo,
+    (httpx.HTTPError, httpx.TimeoutException),
+    max_tries=3,
+    giveup=_is_permanent_error
+)
+async def _do_get(
+    client: httpx.AsyncClient,
+    url: str,
+    headers: Dict[str, str],
+    params: Dict[str, str]
+) -> Dict:
+    response = await client.get(url, headers=headers, params=params)
+    response.raise_for_status()
+    return orjson.loads(response.content)
+
+@functools.lru_cache(maxsize=8)
+def _dates_in_year(year: int) -> Tuple[str, ...]:
+    """All YYYY-MM-DD strings of a year, computed once per year"""
+    start = date(year, 1, 1).toordinal()
+    end = date(year, 12, 31).toordinal()
+    return tuple(date.fromordinal(day).isoformat() for day in range(start, end + 1))
+
+# Validates the collected submissions in one call instead of one model at a time
+_SUBMISSIONS_ADAPTER = TypeAdapter(List[LeetCodeSubmission])
+_TAG_STATS_ADAPTER = TypeAdapter(List[TagStat])
+
 class LeetCodeService:
-    def __init__(self):
+    def __init__(
+        self,
+        client: Optional[httpx.AsyncClient] = None,
+        semaphore: Optional[asyncio.Semaphore] = None
+    ):
         self.logger = logger
         self.base_url = "https://leetcode.com/api"
         self.submission_url = f"{self.base_url}/submissions/"
+        self.client = client or get_http_client()
+        self._semaphore = semaphore or asyncio.Semaphore(LEETCODE_MAX_CONCURRENT_REQUESTS)
         
     async def _make_request(self, url: str, headers: Dict[str, str], params: Dict[str, str]) -> Dict:
-        @backoff.on_exception(
-            backoff.expo,
-            (httpx.HTTPError, httpx.TimeoutException),
-            max_tries=3
+        async with self._semaphore:
+            return await _do_get(self.client, url, headers, params)
+
+    async def _fetch_submissions_page(self, headers: Dict[str, str], offset: int) -> Dict:
+        params = {"offset": offset, "limit": SUBMISSIONS_PAGE_SIZE}
+        self.logger.debug("Making request with params: %s", params)
+        return await self._make_request(
+            self.submission_url,
+            headers=headers,
+            params=params
         )
-        async def _fetch():
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, headers=headers, params=params)
-                response.raise_for_status()
-                return response.json()
-        
-        return await _fetch()
 
     async def fetch_all_submissions(
         self,
         csrf_token: str,
         cookie: str,
-        last_sync_timestamp: Optional[datetime] = None
+        last_sync_epoch: Optional[int] = None
     ) -> List[LeetCodeSubmission]:
-        self.logger.info(f"Starting to fetch submissions with timestamp > {last_sync_timestamp}")
+        self.logger.info(f"Starting to fetch submissions with timestamp > {last_sync_epoch}")
         headers = {
             "x-csrftoken": csrf_token,  # Changed from X-CSRFToken to x-csrftoken
             "Cookie": cookie,
@@ -62,76 +142,87 @@ class LeetCodeService:
         }
         self.logger.debug(f"Request headers (masked): {{'x-csrftoken': '***', 'Cookie': '***', 'User-Agent': '{headers['User-Agent']}'}}")
         
-        all_submissions = []
+        # Only the latest submission per question is used, and pages are
+        # newest first, so the first one seen for each question is kept
+        latest_by_question = {}
         offset = 0
-        last_key = ""
+        # The first page is fetched on its own since an incremental sync
+        # rarely needs more; after that pages are prefetched in batches
+        batch_size = 1
+        done = False
         
-        while True:
-            params = {"offset": offset, "limit": 20}
-            if last_key:
-                params["lastkey"] = last_key
+        while not done:
+            offsets = [offset + i * SUBMISSIONS_PAGE_SIZE for i in range(batch_size)]
             
-            self.logger.debug(f"Making request with params: {params}")
+            # A failed page must not discard the pages before it
+            responses = await asyncio.gather(*(
+                self._fetch_submissions_page(headers, page_offset)
+                for page_offset in offsets
+            ), return_exceptions=True)
             
-            try:
-                response = await self._make_request(
-                    self.submission_url,
-                    headers=headers,
-                    params=params
-                )
+            for page_offset, response in zip(offsets, responses):
+                if isinstance(response, Exception):
+                    self.logger.error(f"Error fetching submissions: {str(response)}", exc_info=response)
+                    done = True
+                    break
                 
                 submissions = response.get("submissions_dump", [])
-                self.logger.info(f"Fetched {len(submissions)} submissions for offset {offset}", extra={"offset": offset})
-                # logger.info(submissions, "submissions hereee")
+                self.logger.info(f"Fetched {len(submissions)} submissions for offset {page_offset}", extra={"offset": page_offset})
                 if not submissions:
                     self.logger.info("No more submissions to fetch")
+                    done = True
                     break
                 
-                if last_sync_timestamp:
-                    original_count = len(submissions)
-                    submissions = [
-                        sub for sub in submissions 
-                        if datetime.fromtimestamp(sub["timestamp"]) > last_sync_timestamp
-                    ]
-                    # datetime.fromtimestamp(submission.timestamp)
-                    self.logger.debug(f"Filtered {original_count - len(submissions)} old submissions", extra={"filtered": original_count - len(submissions)})
-                    if not submissions:
+                # Filter and deduplicate in a single pass over the page
+                for sub in submissions:
+                    if last_sync_epoch is not None and sub["timestamp"] <= last_sync_epoch:
+                        # Submissions come back newest first, so everything
+                        # from here on, including later pages, is older too
                         self.logger.info("All remaining submissions are older than last sync")
+                        done = True
                         break
+                    latest_by_question.setdefault(sub["question_id"], sub)
+                if done:
+                    break
                 
-                all_submissions.extend(submissions)
-                
-                if not response.get("has_next"):
+                if not response.get("has_next") or len(submissions) < SUBMISSIONS_PAGE_SIZE:
                     self.logger.info("No more pages to fetch")
+                    done = True
                     break
-                
-                last_key = response.get("last_key", "")
-                offset += 20
-                
-                self.logger.debug(f"Moving to next page with offset {offset}")
-                await asyncio.sleep(2)
-                
-            except Exception as e:
-                self.logger.error(f"Error fetching submissions: {str(e)}", exc_info=True)
-                break
+            
+            offset += batch_size * SUBMISSIONS_PAGE_SIZE
+            batch_size = SUBMISSIONS_PREFETCH_PAGES
+            
+            if not done:
+                self.logger.debug("Moving to next batch with offset %s", offset)
         
-        self.logger.info(f"Successfully fetched total {len(all_submissions)} submissions")
-        return [LeetCodeSubmission(**sub) for sub in all_submissions]
+        self.logger.info(f"Successfully fetched submissions for {len(latest_by_question)} questions")
+        return _SUBMISSIONS_ADAPTER.validate_python(list(latest_by_question.values()))
 
     @staticmethod
+    @functools.lru_cache(maxsize=4096)
     def _get_difficulty(question_id: int) -> str:
         return "medium"  # Default to medium for now
 
     @staticmethod
-    def _get_topics(question_id: int) -> List[str]:
-        return ["algorithms"]  # Default topic
+    @functools.lru_cache(maxsize=4096)
+    def _get_topics(question_id: int) -> Tuple[str, ...]:
+        # A tuple, since every caller shares the cached result
+        return ("algorithms",)  # Default topic
 
 class AnalyticsService:
-    def __init__(self):
+    def __init__(self, redis_service: Optional[RedisService] = None):
         self.logger = logger
-        self.leetcode_service = LeetCodeService()
-        self.graphql_service = LeetCodeGraphQLService()
-        self.redis_service = RedisService(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+        # One cap on in-flight LeetCode requests shared by submissions paging
+        # and GraphQL so running both concurrently can't burst past it
+        self._sem = asyncio.Semaphore(LEETCODE_MAX_CONCURRENT_REQUESTS)
+        self.leetcode_service = LeetCodeService(semaphore=self._sem)
+        self.graphql_service = LeetCodeGraphQLService(semaphore=self._sem)
+        self.redis_service = redis_service or RedisService(REDIS_URL)
+
+    async def aclose(self) -> None:
+        """Release HTTP connections held by the underlying services"""
+        await self.graphql_service.aclose()
     
     def process_problem_stats(self, stats_data: Dict) -> ProblemCounts:
         """Process problem statistics into ProblemCounts model"""
@@ -142,25 +233,25 @@ class AnalyticsService:
                 beats={}
             )
 
+        matched_user = stats_data.get("matchedUser") or {}
+        submit_stats = matched_user.get("submitStatsGlobal") or {}
+
         # Process total counts
         total_counts = {
             item["difficulty"]: item["count"]
-            for item in stats_data.get("allQuestionsCount", [])
+            for item in stats_data.get("allQuestionsCount") or []
         }
 
         # Process solved counts
         solved_counts = {
             item["difficulty"]: item["count"]
-            for item in stats_data.get("matchedUser", {})
-                .get("submitStatsGlobal", {})
-                .get("acSubmissionNum", [])
+            for item in submit_stats.get("acSubmissionNum") or []
         }
 
         # Process beats stats
         beats_stats = {
             item["difficulty"]: item["percentage"]
-            for item in stats_data.get("matchedUser", {})
-                .get("problemsSolvedBeatsStats", [])
+            for item in matched_user.get("problemsSolvedBeatsStats") or []
         }
 
         return ProblemCounts(
@@ -174,7 +265,10 @@ class AnalyticsService:
         user_id: str,
         csrf_token: str,
         username: str,
-        cookie: str
+        cookie: str,
+        full_recount: bool = False,
+        cache_stats: bool = True,
+        write_ops: Optional[List[UpdateOne]] = None
     ) -> UserProgress:
         self.logger.info(f"Starting sync for user: {user_id}", extra={"user_id": user_id, "username": username})
 
@@ -190,19 +284,22 @@ class AnalyticsService:
                 aggregated_stats=AggregatedStats()
             )
         
-        last_sync_timestamp = user_progress.progress_data.leetcode.questions[0].last_attempted if len(user_progress.progress_data.leetcode.questions) > 0 else None
+        leetcode_progress = user_progress.progress_data.leetcode
+        last_sync_epoch = leetcode_progress.questions[0].last_attempted if leetcode_progress and leetcode_progress.questions else None
         
         # Create tasks for parallel execution
         submissions_task = self.leetcode_service.fetch_all_submissions(
             csrf_token,
             cookie,
-            last_sync_timestamp=last_sync_timestamp
+            last_sync_epoch=last_sync_epoch
         )
         
+        # The stats are persisted, so never take them from the response cache
         stats_task = self.graphql_service.fetch_all_stats(
             username,
             csrf_token,
-            cookie
+            cookie,
+            use_cache=False
         )
         
         submissions, (
@@ -218,70 +315,59 @@ class AnalyticsService:
         
         self.logger.info(f"Fetched all data for user {user_id}", extra={"user_id": user_id})
 
-        questions_map = {}
-        for submission in submissions:
-            question_id = str(submission.question_id)
-            
-            if question_id in questions_map:
-                continue
-                
-            self.logger.debug(f"Processing submission for question {submission.title}", extra={"question_id": question_id})
-            questions_map[question_id] = Question(
-                id=question_id,
-                name=submission.title,
-                difficulty=self.leetcode_service._get_difficulty(submission.question_id),
-                topics=self.leetcode_service._get_topics(submission.question_id),
-                status="solved" if submission.status_display == "Accepted" else "attempted",
-                attempts=1,
-                time_spent=0,
-                last_attempted=datetime.fromtimestamp(submission.timestamp)
-            )
-
-        if user_progress.progress_data.leetcode is None:
+        leetcode_initialized = user_progress.progress_data.leetcode is None
+        if leetcode_initialized:
             self.logger.info("Initializing LeetCode progress data")
             user_progress.progress_data.leetcode = PlatformProgress(questions=[])
             
-        existing_questions = {
-            q.id: q for q in user_progress.progress_data.leetcode.questions
-        }
+        questions = user_progress.progress_data.leetcode.questions
+        existing_questions = {q.id: q for q in questions}
         new_questions = []
+        updated_questions = []
+        # Change in solved questions, used when LeetCode's own total is unavailable
+        delta_solved = 0
         
-        for qid, question in questions_map.items():
-            if qid in existing_questions:
-                self.logger.debug(f"Updating existing question {qid}")
-                existing = existing_questions[qid]
-                existing.status = question.status
-                existing.last_attempted = question.last_attempted
+        # Submissions are unique per question, so merge them in a single pass
+        for submission in submissions:
+            question_id = str(submission.question_id)
+            self.logger.debug("Processing submission for question %s", submission.title, extra={"question_id": question_id})
+            status = "solved" if submission.status_display == "Accepted" else "attempted"
+            last_attempted = submission.timestamp
+            
+            existing = existing_questions.get(question_id)
+            if existing is not None:
+                self.logger.debug("Updating existing question %s", question_id)
+                delta_solved += (status == "solved") - (existing.status == "solved")
+                existing.status = status
+                existing.last_attempted = last_attempted
+                updated_questions.append(existing)
                 # existing.attempts += 1
             else:
-                self.logger.debug(f"Adding new question {qid}")
-                new_questions.append(question)
-                # user_progress.progress_data.leetcode.questions.append(question)
+                self.logger.debug("Adding new question %s", question_id)
+                delta_solved += status == "solved"
+                new_questions.append(Question(
+                    id=question_id,
+                    name=submission.title,
+                    status=status,
+                    last_attempted=last_attempted
+                ))
 
-        user_progress.progress_data.leetcode.questions = new_questions + list(existing_questions.values())
+        # New questions go to the front in place, newest first
+        questions[:0] = new_questions
         self.logger.info("Updating user statistics", extra={"user_id": user_id})
-        user_progress.last_updated = datetime.utcnow()
+        user_progress.last_updated = datetime.now(_UTC)
 
         if tag_stats:
-            user_progress.aggregated_stats.tag_stats = TagStats(
-                advanced=[
-                    TagStat(**tag) for tag in tag_stats.get("advanced", [])
-                ],
-                intermediate=[
-                    TagStat(**tag) for tag in tag_stats.get("intermediate", [])
-                ],
-                fundamental=[
-                    TagStat(**tag) for tag in tag_stats.get("fundamental", [])
-                ]
-            )
-            
-            # Update by_topic with combined stats
-            topic_counts = {}
-            for category in ["advanced", "intermediate", "fundamental"]:
-                for tag in tag_stats.get(category, []):
-                    topic_counts[tag["tagSlug"]] = tag["problemsSolved"]
-            
-            user_progress.aggregated_stats.by_topic = topic_counts
+            tag_groups = {category: tag_stats.get(category) or [] for category in TAG_CATEGORIES}
+            # Tags come from LeetCode, so validate each category list in one call
+            user_progress.aggregated_stats.tag_stats = TagStats.model_construct(**{
+                category: _TAG_STATS_ADAPTER.validate_python(tags)
+                for category, tags in tag_groups.items()
+            })
+            user_progress.aggregated_stats.by_topic = {
+                tag["tagSlug"]: tag["problemsSolved"]
+                for tag in itertools.chain.from_iterable(tag_groups.values())
+            }
         
         if language_stats:
             user_progress.aggregated_stats.by_language = [
@@ -293,6 +379,13 @@ class AnalyticsService:
             user_progress.aggregated_stats.problem_counts = self.process_problem_stats(problem_stats)
             total_solved = user_progress.aggregated_stats.problem_counts.solved.get('All')
             user_progress.aggregated_stats.total_solved = total_solved
+        elif full_recount:
+            user_progress.aggregated_stats.total_solved = sum(
+                1 for q in user_progress.progress_data.leetcode.questions
+                if q.status == "solved"
+            )
+        else:
+            user_progress.aggregated_stats.total_solved += delta_solved
         
         if calendar_data:
             user_progress.aggregated_stats.calendar_stats = (
@@ -306,12 +399,34 @@ class AnalyticsService:
 
         self.logger.info("Saving progress to MongoDB", extra={"user_id": user_id})
         try:
-            await user_progress.save()
-            self.logger.info("Successfully saved user progress to mongodb", extra={"user_id": user_id})
-            await self.redis_service.store_aggregated_stats(
-                user_id,
-                user_progress.aggregated_stats.dict()
-            )
+            if write_ops is not None:
+                # Batch callers write every user's operations together in flush_many
+                write_ops.extend(self._progress_write_ops(
+                    user_progress,
+                    new_questions,
+                    updated_questions,
+                    leetcode_initialized
+                ))
+            elif user_progress.id is None:
+                await user_progress.insert()
+                self.logger.info("Successfully saved user progress to mongodb", extra={"user_id": user_id})
+            else:
+                await self._save_progress_delta(
+                    user_progress,
+                    new_questions,
+                    updated_questions,
+                    leetcode_initialized
+                )
+                self.logger.info("Successfully saved user progress to mongodb", extra={"user_id": user_id})
+            # Batch callers cache the stats themselves in one pipeline
+            if cache_stats:
+                await self.redis_service.store_aggregated_stats(
+                    user_id,
+                    user_progress.aggregated_stats
+                )
+            # Batch callers invalidate heatmaps once their writes are flushed
+            if calendar_data and write_ops is None:
+                await self.redis_service.invalidate_calendar_heatmap(user_id)
             self.logger.info("Successfully saved user progress to redis")
         except Exception as e:
             self.logger.error(f"Failed to save user progress: {str(e)}", exc_info=True)
@@ -319,18 +434,120 @@ class AnalyticsService:
             
         return user_progress
 
+    async def flush_many(self, user_ops: Dict[str, List[UpdateOne]]) -> Set[str]:
+        """Write operations collected from many syncs in one bulk request
+
+        Returns the ids of the users any of whose operations failed.
+        """
+        write_ops = []
+        owners = []
+        for user_id, ops in user_ops.items():
+            write_ops.extend(ops)
+            owners.extend(itertools.repeat(user_id, len(ops)))
+        if not write_ops:
+            return set()
+        try:
+            # Each user's operations touch disjoint questions, so they can be applied in any order
+            result = await UserProgress.get_motor_collection().bulk_write(write_ops, ordered=False)
+        except BulkWriteError as e:
+            # Unordered, so every operation without an error was still applied
+            write_errors = e.details.get("writeErrors", [])
+            failed = {owners[error["index"]] for error in write_errors}
+            # The failed operations themselves hold ObjectIds and datetimes
+            # the JSON log formatter can't encode, so log only the error
+            self.logger.error(
+                f"{len(write_errors)} of {len(write_ops)} progress writes failed for {len(failed)} users",
+                extra={"write_errors": [
+                    {"index": error["index"], "code": error.get("code"), "errmsg": error.get("errmsg")}
+                    for error in write_errors[:10]
+                ]}
+            )
+            return failed
+        self.logger.info(
+            f"Flushed {len(write_ops)} progress writes",
+            extra={"upserted": result.upserted_count, "modified": result.modified_count}
+        )
+        return set()
+
+    async def _save_progress_delta(
+        self,
+        user_progress: UserProgress,
+        new_questions: List[Question],
+        updated_questions: List[Question],
+        leetcode_initialized: bool = False
+    ) -> None:
+        """Write only the changed questions and stats instead of the whole document"""
+        operations = self._progress_write_ops(
+            user_progress,
+            new_questions,
+            updated_questions,
+            leetcode_initialized
+        )
+        await UserProgress.get_motor_collection().bulk_write(operations, ordered=True)
+        self.logger.debug(
+            f"Wrote {len(new_questions)} new and {len(updated_questions)} updated questions",
+            extra={"user_id": user_progress.user_id}
+        )
+
+    @staticmethod
+    def _progress_write_ops(
+        user_progress: UserProgress,
+        new_questions: List[Question],
+        updated_questions: List[Question],
+        leetcode_initialized: bool = False
+    ) -> List[UpdateOne]:
+        """Operations persisting a sync: the whole document for a new user, else only what changed"""
+        if user_progress.id is None:
+            return [UpdateOne(
+                {"user_id": user_progress.user_id},
+                {"$setOnInsert": user_progress.model_dump(exclude={"id", "revision_id"})},
+                upsert=True
+            )]
+        
+        update = {
+            "$set": {
+                "aggregated_stats": user_progress.aggregated_stats.model_dump(),
+                "last_updated": user_progress.last_updated
+            }
+        }
+        if leetcode_initialized:
+            # There is no stored questions array to push onto yet
+            update["$set"]["progress_data.leetcode"] = (
+                user_progress.progress_data.leetcode.model_dump()
+            )
+        elif new_questions:
+            # New questions are kept at the front, newest first
+            update["$push"] = {
+                "progress_data.leetcode.questions": {
+                    "$each": [q.model_dump() for q in new_questions],
+                    "$position": 0
+                }
+            }
+        
+        document_filter = {"_id": user_progress.id}
+        if "$push" in update:
+            # A replayed or overlapping sync must not push the same questions
+            # again; it then leaves the stats alone too, so they stay in step
+            document_filter["progress_data.leetcode.questions.id"] = {
+                "$nin": [q.id for q in new_questions]
+            }
+        operations = [UpdateOne(document_filter, update)]
+        operations.extend(
+            UpdateOne(
+                {"_id": user_progress.id, "progress_data.leetcode.questions.id": q.id},
+                {"$set": {
+                    "progress_data.leetcode.questions.$.status": q.status,
+                    "progress_data.leetcode.questions.$.last_attempted": q.last_attempted
+                }}
+            )
+            for q in updated_questions
+        )
+        return operations
+
     def calculate_submission_intensity(self, count: int) -> int:
         """Calculate color intensity based on submission count"""
-        if count == 0:
-            return 0
-        elif count <= 3:
-            return 1
-        elif count <= 6:
-            return 2
-        elif count <= 10:
-            return 3
-        else:
-            return 4  # Maximum intensity
+        # Number of thresholds the count exceeds: 0, 1-3, 4-6, 7-10, 11+ -> 0..4
+        return bisect.bisect_left(_INTENSITY_THRESHOLDS, count)
 
     async def get_calendar_heatmap(
         self,
@@ -338,32 +555,33 @@ class AnalyticsService:
         year: Optional[int] = None
     ) -> Dict:
         """Get calendar heatmap data for visualization"""
-        user_progress = await UserProgress.find_one({"user_id": user_id})
-        if not user_progress or not user_progress.aggregated_stats.calendar_stats:
+        year = year or datetime.now().year
+        cached = await self.redis_service.get_calendar_heatmap(user_id, year)
+        if cached is not None:
+            return cached
+
+        user_stats = await UserProgress.find_one(
+            {"user_id": user_id},
+            projection_model=UserStatsView
+        )
+        if not user_stats or not user_stats.aggregated_stats.calendar_stats:
             return {}
 
-        calendar_stats = user_progress.aggregated_stats.calendar_stats
-        year = year or datetime.now().year
+        calendar_stats = user_stats.aggregated_stats.calendar_stats
 
         # Create full year data with intensity levels
-        start_date = datetime(year, 1, 1)
-        end_date = datetime(year, 12, 31)
-        current_date = start_date
-
-        heatmap_data = {}
-        while current_date <= end_date:
-            date_str = current_date.strftime("%Y-%m-%d")
-            count = calendar_stats.submissions_by_date.get(date_str, 0)
-            intensity = self.calculate_submission_intensity(count)
-            
-            heatmap_data[date_str] = {
+        dates = _dates_in_year(year)
+        submissions_by_date = calendar_stats.submissions_by_date
+        counts = [submissions_by_date.get(date_str, 0) for date_str in dates]
+        heatmap_data = {
+            date_str: {
                 "count": count,
-                "intensity": intensity
+                "intensity": self.calculate_submission_intensity(count)
             }
-            
-            current_date = current_date + timedelta(days=1)
+            for date_str, count in zip(dates, counts)
+        }
 
-        return {
+        heatmap = {
             "heatmap": heatmap_data,
             "stats": {
                 "total_submissions": sum(calendar_stats.submissions_by_date.values()),
@@ -373,3 +591,5 @@ class AnalyticsService:
                 "yearly_totals": calendar_stats.yearly_submissions
             }
         }
+        await self.redis_service.store_calendar_heatmap(user_id, year, heatmap)
+        return heatmap
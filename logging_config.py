@@ -1,15 +1,20 @@
 import logging
-import json
+import orjson
 import sys
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Any, Dict
 
 class JSONFormatter(logging.Formatter):
     """Custom JSON formatter for structured logging"""
     
+    def __init__(self, service_name: str = 'analytics'):
+        super().__init__()
+        self._service_field: Dict[str, Any] = {'service': service_name}
+    
     def format(self, record: logging.LogRecord) -> str:
         record_dict: Dict[str, Any] = {
-            'timestamp': datetime.utcnow().isoformat(),
+            **self._service_field,
+            'timestamp': datetime.now(timezone.utc),
             'level': record.levelname,
             'message': record.getMessage(),
             'module': record.module,
@@ -25,25 +30,20 @@ class JSONFormatter(logging.Formatter):
         if hasattr(record, 'extra_fields'):
             record_dict.update(record.extra_fields)
             
-        return json.dumps(record_dict)
+        return orjson.dumps(record_dict, option=orjson.OPT_UTC_Z).decode()
 
 def setup_logging(service_name: str = 'analytics', level: str = 'INFO') -> None:
     """Setup structured logging"""
     root_logger = logging.getLogger()
     
     # Remove existing handlers
-    for handler in root_logger.handlers:
+    for handler in root_logger.handlers[:]:
         root_logger.removeHandler(handler)
     
     # Create console handler with JSON formatter
     handler = logging.StreamHandler(sys.stdout)
-    handler.setFormatter(JSONFormatter())
+    handler.setFormatter(JSONFormatter(service_name))
     
     # Set logging level
     root_logger.setLevel(level)
-    root_logger.addHandler(handler)
-    
-    # Add service name to all logs
-    logging.LogRecord = type('LogRecord', (logging.LogRecord,), {
-        'extra_fields': {'service': service_name}
-    })
\ No newline at end of file
+    root_logger.addHandler(handler)
\ No newline at end of file
@@ -1,17 +1,19 @@
-from fastapi import FastAPI, HTTPException, Header, Query, Request
+from fastapi import Depends, FastAPI, HTTPException, Header, Query, Request
 from prometheus_client import Counter, Summary, generate_latest, REGISTRY
+from fastapi.responses import ORJSONResponse
 from starlette.responses import Response
 from celery.result import AsyncResult
 from sse_starlette.sse import EventSourceResponse
 import asyncio
 import json
+import orjson
 from datetime import datetime
 from typing import List, Optional
-from models import UserProgress, AggregatedStats
-from leetcode_service import AnalyticsService
-from config import init_db
+from models import UserProgress, UserStatsView, AggregatedStats
+from leetcode_service import AnalyticsService, close_http_client
+from config import init_db, close_db
 from tasks import sync_user_leetcode_data, celery_app, check_celery_status
-from redis_service import RedisService
+from redis_service import REDIS_URL, RedisService
 from fastapi.middleware.cors import CORSMiddleware
 from tester import setup_logging
 import os
@@ -23,12 +25,16 @@ logger = setup_logging()
 app = FastAPI(
     title="DevQuest Analytics Service",
     description="API for managing user progress analytics",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 REQUEST_COUNT = Counter('app_request_count', 'Total number of requests', ['method', 'endpoint'])
 REQUEST_LATENCY = Summary('app_request_latency_seconds', 'Request latency')
 
+# How often an open sync stream sends a progress event while waiting
+SSE_HEARTBEAT_SECONDS = 15
+
 # Configure CORS
 origins = [
     "http://localhost:3000",      # React development server
@@ -69,6 +75,17 @@ async def prometheus_metrics_middleware(request: Request, call_next):
 @app.on_event("startup")
 async def startup_event():
     await init_db()
+    # One Redis client (and connection pool) for the whole app
+    app.state.redis = RedisService(REDIS_URL)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await app.state.redis.close()
+    await close_http_client()
+    close_db()
+
+def get_redis_service(request: Request) -> RedisService:
+    return request.app.state.redis
 
 @app.get("/metrics")
 async def metrics():
@@ -81,12 +98,12 @@ async def sync_user_data(
     user_id: str,
     username: str = Query(..., description="LeetCode username"),
     x_csrftoken: str = Header(..., alias="x-csrftoken"),  # Changed from csrf_token to x_csrftoken
-    cookie: str = Header(..., alias="foo")
+    cookie: str = Header(..., alias="foo"),
+    redis_service: RedisService = Depends(get_redis_service)
 ):
     logger.info(f"Received sync request for user {user_id} with username {username}", extra={ 'user_id': user_id })
     try:
         # Try Redis first
-        redis_service = RedisService(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
         stats = await redis_service.get_aggregated_stats(user_id)
     
         if stats:
@@ -132,53 +149,67 @@ async def test_logging():
 
 @app.get("/api/v1/sync/{user_id}/stream/{task_id}")
 async def get_sync_status(user_id: str, task_id: str):
+    redis_service: RedisService = app.state.redis
+
     async def event_generator():
-        while True:
-            # Check task status
-            try:
-                task = sync_user_leetcode_data.AsyncResult(task_id)
-                
-                if task.ready():
-                    if task.successful():
-                        # Fetch the final stats
-                        stats = await get_stats(user_id)
-                        yield {
-                            "event": "complete",
-                            "data": json.dumps({
-                                "status": "completed",
-                                "stats": stats
-                            })
-                        }
-                        break
-                    else:
-                        yield {
-                            "event": "error",
-                            "data": json.dumps({
-                                "status": "failed",
-                                "error": str(task.result)
-                            })
-                        }
-                        break
-                else:
-                    yield {
-                        "event": "progress",
-                        "data": json.dumps({
-                            "status": "in_progress",
-                            "timestamp": datetime.now().isoformat()
-                        })
-                    }
-                
-                await asyncio.sleep(2)  # Check every 2 seconds
-                
-            except Exception as e:
+        # The task publishes its outcome on this channel, so we only wake up
+        # when it finishes or when a heartbeat is due
+        redis = await redis_service.get_redis()
+        pubsub = redis.pubsub()
+        await pubsub.subscribe(RedisService.sync_channel(user_id, task_id))
+        try:
+            # The task may have finished before we subscribed
+            task = sync_user_leetcode_data.AsyncResult(task_id)
+            if task.ready():
+                outcome = (
+                    {"status": "completed"} if task.successful()
+                    else {"status": "failed", "error": str(task.result)}
+                )
+            else:
+                outcome = None
+
+            while outcome is None:
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True,
+                    timeout=SSE_HEARTBEAT_SECONDS
+                )
+                if message is not None:
+                    outcome = orjson.loads(message["data"])
+                    break
                 yield {
-                    "event": "error",
+                    "event": "progress",
                     "data": json.dumps({
-                        "status": "error",
-                        "error": str(e)
+                        "status": "in_progress",
+                        "timestamp": datetime.now().isoformat()
                     })
                 }
-                break
+
+            if outcome["status"] == "completed":
+                # Fetch the final stats and embed their JSON without re-encoding it
+                stats_payload = await load_stats_payload(user_id, redis_service)
+                yield {
+                    "event": "complete",
+                    "data": orjson.dumps({
+                        "status": "completed",
+                        "stats": orjson.Fragment(stats_payload)
+                    }).decode()
+                }
+            else:
+                yield {
+                    "event": "error",
+                    "data": json.dumps(outcome)
+                }
+        except Exception as e:
+            yield {
+                "event": "error",
+                "data": json.dumps({
+                    "status": "error",
+                    "error": str(e)
+                })
+            }
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.aclose()
 
     return EventSourceResponse(event_generator())
 
@@ -189,34 +220,44 @@ async def get_progress(user_id: str):
         raise HTTPException(status_code=404, detail="User progress not found")
     return user_progress
 
-@app.get("/api/v1/stats/{user_id}")
-async def get_stats(user_id: str):
-    # Try Redis first
-    redis_service = RedisService(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
-    stats = await redis_service.get_aggregated_stats(user_id)
-    
-    # if stats:
-    #     return stats
+async def load_stats_payload(user_id: str, redis_service: RedisService) -> bytes:
+    """A user's aggregated stats as JSON bytes, from Redis when cached"""
+    # Try Redis first, returning the cached JSON as-is
+    cached = await redis_service.get_aggregated_stats_raw(user_id)
+    if cached:
+        return cached
 
     # Fallback to MongoDB
-    user_progress = await UserProgress.find_one({"user_id": user_id})
+    user_progress = await UserProgress.find_one(
+        {"user_id": user_id},
+        projection_model=UserStatsView
+    )
     if not user_progress:
         # call sync_user_data to fetch the data
-        analytics_service = AnalyticsService()
+        analytics_service = AnalyticsService(redis_service=redis_service)
         logger.info(f"Starting sync_user_submissions for user {user_id}")
-        user_progress = await analytics_service.sync_user_submissions(
-            user_id=user_id,
-            csrf_token="csrf_token",
-            cookie="cookie",
-            username=user_id
-        )
+        try:
+            user_progress = await analytics_service.sync_user_submissions(
+                user_id=user_id,
+                csrf_token="csrf_token",
+                cookie="cookie",
+                username=user_id
+            )
+        finally:
+            await analytics_service.aclose()
         logger.info(f"Completed sync_user_submissions for user {user_id}")
         # raise HTTPException(status_code=404, detail="User statistics not found")
     
-    # Cache the stats in Redis
-    await redis_service.store_aggregated_stats(user_id, user_progress.aggregated_stats.dict())
-    stats = await redis_service.get_aggregated_stats(user_id)
-    return stats
+    # Cache the stats in Redis and return the same bytes
+    return await redis_service.store_aggregated_stats(user_id, user_progress.aggregated_stats)
+
+@app.get("/api/v1/stats/{user_id}")
+async def get_stats(
+    user_id: str,
+    redis_service: RedisService = Depends(get_redis_service)
+):
+    payload = await load_stats_payload(user_id, redis_service)
+    return Response(content=payload, media_type="application/json")
 
 @app.get("/api/v1/leaderboard", response_model=List[UserProgress])
 async def get_leaderboard(limit: int = 10):
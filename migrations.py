@@ -0,0 +1,84 @@
+"""One-off data migrations for the user_progress collection
+
+Run once per deployment, before starting the upgraded API or workers:
+
+    python migrations.py
+
+Every migration is idempotent, so running the script again is harmless.
+"""
+import asyncio
+import logging
+import os
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+logger = logging.getLogger('devquest.migrations')
+
+USER_ID_INDEX = "user_id_1"
+
+
+async def user_id_index_needs_migration(db: AsyncIOMotorDatabase) -> bool:
+    """Whether user_id_1 exists from before it was made unique"""
+    indexes = await db.user_progress.index_information()
+    index = indexes.get(USER_ID_INDEX)
+    return index is not None and not index.get("unique", False)
+
+
+async def migrate_unique_user_id(db: AsyncIOMotorDatabase) -> None:
+    """Remove duplicate users, then rebuild user_id_1 as a unique index"""
+    collection = db.user_progress
+    duplicates = collection.aggregate([
+        {"$sort": {"last_updated": -1}},
+        {"$group": {"_id": "$user_id", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ])
+    async for group in duplicates:
+        # Keep the most recently updated document of each user
+        stale_ids = group["ids"][1:]
+        await collection.delete_many({"_id": {"$in": stale_ids}})
+        logger.warning(f"Removed {len(stale_ids)} duplicate documents for user {group['_id']}")
+
+    if await user_id_index_needs_migration(db):
+        await collection.drop_index(USER_ID_INDEX)
+        logger.info(f"Dropped non-unique {USER_ID_INDEX}")
+    await collection.create_index("user_id", unique=True, name=USER_ID_INDEX)
+    logger.info(f"{USER_ID_INDEX} is unique")
+
+
+async def migrate_last_attempted_to_epoch(db: AsyncIOMotorDatabase) -> None:
+    """Rewrite datetime Question.last_attempted values as epoch seconds"""
+    questions = "progress_data.leetcode.questions"
+    # Delta saves only rewrite the questions they touch, so a document
+    # can hold a mix of datetimes and ints; convert just the datetimes
+    result = await db.user_progress.update_many(
+        {f"{questions}.last_attempted": {"$type": "date"}},
+        [{"$set": {questions: {"$map": {
+            "input": f"${questions}",
+            "as": "q",
+            "in": {"$cond": [
+                {"$eq": [{"$type": "$$q.last_attempted"}, "date"]},
+                {"$mergeObjects": ["$$q", {"last_attempted": {
+                    "$toLong": {"$divide": [{"$toLong": "$$q.last_attempted"}, 1000]}
+                }}]},
+                "$$q"
+            ]}
+        }}}}]
+    )
+    logger.info(f"Converted last_attempted to epoch seconds in {result.modified_count} documents")
+
+
+async def run_migrations(db: AsyncIOMotorDatabase) -> None:
+    await migrate_unique_user_id(db)
+    await migrate_last_attempted_to_epoch(db)
+
+
+async def main() -> None:
+    # config imports this module for its startup check
+    from config import get_client, close_db
+    try:
+        await run_migrations(get_client()[os.getenv("DB_NAME")])
+    finally:
+        close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,13 +1,33 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import List, Dict, Optional
 from beanie import Document, Indexed
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, field_serializer, field_validator
 
 class Question(BaseModel):
     id: str
     name: str
     status: str
-    last_attempted: datetime
+    # Unix epoch seconds, as LeetCode reports submission times
+    last_attempted: int
+
+    @field_validator("last_attempted", mode="before")
+    @classmethod
+    def _epoch_from_datetime(cls, value):
+        # Documents not yet migrated by migrations.py hold a naive UTC datetime
+        if isinstance(value, datetime):
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=timezone.utc)
+            return int(value.timestamp())
+        return value
+
+    @field_serializer("last_attempted", when_used="json")
+    def _epoch_to_datetime(self, value: int) -> datetime:
+        # API responses keep reporting a timestamp
+        return datetime.fromtimestamp(value, tz=timezone.utc)
+
+    @property
+    def last_attempted_at(self) -> datetime:
+        return datetime.fromtimestamp(self.last_attempted, tz=timezone.utc)
 
 class PlatformProgress(BaseModel):
     questions: List[Question]
@@ -18,6 +38,8 @@ class DifficultyStats(BaseModel):
     hard: int = 0
 
 class TagStat(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     tagName: str
     tagSlug: str
     problemsSolved: int
@@ -32,14 +54,20 @@ class ProgressData(BaseModel):
     geeksforgeeks: Optional[PlatformProgress]
 
 class LanguageStat(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     languageName: str
     problemsSolved: int
 
 class DifficultyCount(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     difficulty: str
     count: int
 
 class DifficultyPercentage(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     difficulty: str
     percentage: Optional[float]
 
@@ -52,6 +80,8 @@ class ProblemCounts(BaseModel):
     beats: Dict[str, Optional[float]]  # e.g., {"Easy": 76.39, ...}
 
 class CalendarStreak(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     current: int = 0
     longest: int = 0  # We can track longest streak too
 
@@ -66,6 +96,8 @@ class CalendarStats(BaseModel):
     streaks: CalendarStreak = Field(default_factory=CalendarStreak)
 
 class Badge(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     display_name: str
     icon_url: str
 
@@ -81,7 +113,7 @@ class AggregatedStats(BaseModel):
     badges: List[Badge] = Field(default_factory=list)
 
 class UserProgress(Document):
-    user_id: Indexed(str)
+    user_id: Indexed(str, unique=True)
     progress_data: ProgressData
     aggregated_stats: AggregatedStats
     last_updated: datetime = Field(default_factory=datetime.utcnow)
@@ -89,6 +121,11 @@ class UserProgress(Document):
     class Settings:
         name = "user_progress"
         indexes = [
-            [("user_id", 1)],
-            [("aggregated_stats.total_solved", -1)]
-        ]
\ No newline at end of file
+            [("aggregated_stats.total_solved", -1)],
+            # Covers the periodic sync's stale-user scan
+            [("last_updated", 1), ("user_id", 1)]
+        ]
+
+class UserStatsView(BaseModel):
+    """Projection of UserProgress for readers that don't need the question list"""
+    aggregated_stats: AggregatedStats
\ No newline at end of file
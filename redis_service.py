@@ -1,37 +1,166 @@
-import aioredis
-import json
-from typing import Dict, Optional
-from models import UserProgress
+import asyncio
+import hashlib
+from redis import asyncio as aioredis
+import orjson
+from typing import Dict, Iterable, Optional, Tuple
+from models import UserProgress, AggregatedStats
 import logging
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
 
 logger = logging.getLogger('devquest.redis')
 
+# Read once at import; the URL doesn't change at runtime
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+STATS_CACHE_TTL = 3600  # 1 hour
+HEATMAP_CACHE_TTL = 300  # 5 minutes
+# Sized for a batch of concurrent syncs each holding a connection
+REDIS_MAX_CONNECTIONS = 64
+
+def _stats_digest(payload: bytes) -> bytes:
+    """Short fingerprint of a stats payload, stored next to it to detect unchanged writes"""
+    return hashlib.blake2b(payload, digest_size=8).digest()
+
 class RedisService:
     def __init__(self, redis_url: str):
         self.redis_url = redis_url
         self._redis = None
+        self._lock = asyncio.Lock()
 
     async def get_redis(self) -> aioredis.Redis:
         if self._redis is None:
-            self._redis = await aioredis.from_url(self.redis_url)
+            # Concurrent first callers must share a single pool
+            async with self._lock:
+                if self._redis is None:
+                    self._redis = await aioredis.from_url(
+                        self.redis_url,
+                        max_connections=REDIS_MAX_CONNECTIONS,
+                        decode_responses=False,
+                        socket_keepalive=True
+                    )
         return self._redis
 
-    async def store_aggregated_stats(self, user_id: str, stats: Dict) -> None:
+    @staticmethod
+    def sync_channel(user_id: str, task_id: str) -> str:
+        """Pub/sub channel on which a sync task announces that it finished"""
+        return f"sync:{user_id}:{task_id}"
+
+    async def close(self) -> None:
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    async def store_aggregated_stats(self, user_id: str, stats: AggregatedStats) -> bytes:
+        """Cache a user's stats and return the JSON payload that was cached"""
         try:
             redis = await self.get_redis()
             key = f"user:stats:{user_id}"
-            await redis.set(key, json.dumps(stats), ex=3600)  # 1 hour expiration
+            digest_key = f"user:stats:h:{user_id}"
+            # Serialise straight to JSON bytes, without an intermediate dict
+            payload = stats.model_dump_json().encode()
+            digest = _stats_digest(payload)
+            
+            if await redis.get(digest_key) == digest:
+                # Unchanged since the last write, so only push the expiry back
+                async with redis.pipeline(transaction=False) as pipe:
+                    pipe.expire(key, STATS_CACHE_TTL)
+                    pipe.expire(digest_key, STATS_CACHE_TTL)
+                    stats_refreshed, _ = await pipe.execute()
+                if stats_refreshed:
+                    logger.info(f"Stats unchanged in Redis for user {user_id}")
+                    return payload
+            
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.set(key, payload, ex=STATS_CACHE_TTL)
+                pipe.set(digest_key, digest, ex=STATS_CACHE_TTL)
+                await pipe.execute()
             logger.info(f"Stored stats in Redis for user {user_id}")
+            return payload
+        except Exception as e:
+            logger.error(f"Failed to store stats in Redis: {str(e)}")
+            raise
+
+    async def store_aggregated_stats_bulk(self, items: Iterable[Tuple[str, AggregatedStats]]) -> None:
+        """Cache stats for many users in a single round trip"""
+        try:
+            redis = await self.get_redis()
+            stored = 0
+            async with redis.pipeline(transaction=False) as pipe:
+                for user_id, stats in items:
+                    payload = stats.model_dump_json().encode()
+                    # Keep the fingerprint in step so single writes stay correct
+                    pipe.set(f"user:stats:{user_id}", payload, ex=STATS_CACHE_TTL)
+                    pipe.set(f"user:stats:h:{user_id}", _stats_digest(payload), ex=STATS_CACHE_TTL)
+                    stored += 1
+                await pipe.execute()
+            logger.info(f"Stored stats in Redis for {stored} users")
         except Exception as e:
             logger.error(f"Failed to store stats in Redis: {str(e)}")
             raise
 
+    async def get_aggregated_stats_raw(self, user_id: str) -> Optional[bytes]:
+        """Cached stats as the stored JSON bytes, for responses that don't need to decode them"""
+        try:
+            redis = await self.get_redis()
+            return await redis.get(f"user:stats:{user_id}")
+        except Exception as e:
+            logger.error(f"Failed to get stats from Redis: {str(e)}")
+            return None
+
     async def get_aggregated_stats(self, user_id: str) -> Optional[Dict]:
         try:
             redis = await self.get_redis()
             key = f"user:stats:{user_id}"
             data = await redis.get(key)
-            return json.loads(data) if data else None
+            return orjson.loads(data) if data else None
         except Exception as e:
             logger.error(f"Failed to get stats from Redis: {str(e)}")
             return None
+
+    @staticmethod
+    def _heatmap_key(user_id: str) -> str:
+        # One hash per user, with a field per year, so a sync can drop every
+        # year at once; each year's payload embeds the user's live stats
+        return f"user:heatmap:{user_id}"
+
+    async def store_calendar_heatmap(self, user_id: str, year: int, heatmap: Dict) -> None:
+        try:
+            redis = await self.get_redis()
+            key = self._heatmap_key(user_id)
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.hset(key, str(year), orjson.dumps(heatmap))
+                pipe.expire(key, HEATMAP_CACHE_TTL)
+                await pipe.execute()
+        except Exception as e:
+            # The heatmap is cheap to rebuild, so a failed write is not fatal
+            logger.error(f"Failed to store heatmap in Redis: {str(e)}")
+
+    async def get_calendar_heatmap(self, user_id: str, year: int) -> Optional[Dict]:
+        try:
+            redis = await self.get_redis()
+            data = await redis.hget(self._heatmap_key(user_id), str(year))
+            return orjson.loads(data) if data else None
+        except Exception as e:
+            logger.error(f"Failed to get heatmap from Redis: {str(e)}")
+            return None
+
+    async def invalidate_calendar_heatmap(self, user_id: str) -> None:
+        """Invalidate every cached year of a user's heatmap"""
+        try:
+            redis = await self.get_redis()
+            await redis.delete(self._heatmap_key(user_id))
+        except Exception as e:
+            logger.error(f"Failed to invalidate heatmap in Redis: {str(e)}")
+
+    async def invalidate_calendar_heatmaps(self, user_ids: Iterable[str]) -> None:
+        """Invalidate every cached year of many users' heatmaps in a single DEL"""
+        keys = [self._heatmap_key(user_id) for user_id in user_ids]
+        if not keys:
+            return
+        try:
+            redis = await self.get_redis()
+            await redis.delete(*keys)
+        except Exception as e:
+            logger.error(f"Failed to invalidate heatmaps in Redis: {str(e)}")
@@ -1,15 +1,19 @@
 import asyncio
+import orjson
+import redis
 # import nest_asyncio
 from celery import Celery
-from celery.signals import worker_process_init
+from celery.signals import worker_process_init, worker_process_shutdown
 from datetime import datetime, timedelta
 import os
-from typing import List
+import threading
+from typing import List, Optional
 from models import UserProgress, Question
 import logging
-from leetcode_service import AnalyticsService
+from leetcode_service import AnalyticsService, close_http_client
+from redis_service import REDIS_URL, RedisService
 from tester import setup_logging
-from beanie import init_beanie
+from config import init_db, get_client, close_db
 from motor.motor_asyncio import AsyncIOMotorClient
 from functools import wraps
 from dotenv import load_dotenv
@@ -30,10 +34,14 @@ logger = setup_logging()
 
 # Initialize Celery with explicit Redis URL
 # REDIS_URL = "redis://localhost:6379/0"
-REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
-MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017')
-DB_NAME = os.getenv('DB_NAME')
+# Users synced at once by the periodic task, bounded for LeetCode's rate limits
+PERIODIC_SYNC_CONCURRENCY = 16
+# Users synced per batch of the periodic task; each batch is written to
+# MongoDB and cached in Redis before the next one starts
+STATS_CACHE_FLUSH_SIZE = 500
 celery_app = Celery('analytics_tasks')
+# Used to announce finished syncs to SSE listeners
+redis_client = redis.Redis.from_url(REDIS_URL)
 
 # Celery Configuration
 celery_app.conf.update(
@@ -45,6 +53,11 @@ celery_app.conf.update(
     task_track_started=True,
     task_time_limit=30 * 60,
     worker_prefetch_multiplier=1,  # Process one task at a time
+    # Ack only once a task finishes so a crashed worker's task is redelivered.
+    # A redelivered sync replays its writes, which are idempotent; but a task
+    # that itself kills the worker (e.g. OOM) is redelivered indefinitely
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
     task_routes={
         'tasks.sync_user_leetcode_data': {'queue': 'sync'},
         'tasks.update_user_statistics': {'queue': 'stats'},
@@ -52,30 +65,77 @@ celery_app.conf.update(
     }
 )
 
+def publish_sync_event(user_id: str, task_id: str, event: dict) -> None:
+    """Notify SSE listeners waiting on this sync task"""
+    try:
+        redis_client.publish(RedisService.sync_channel(user_id, task_id), orjson.dumps(event))
+    except Exception as e:
+        logger.error(f"Failed to publish sync event for user {user_id}: {str(e)}")
+
 async def init_mongodb():
-    """Initialize MongoDB connection"""
-    client = AsyncIOMotorClient(MONGODB_URI)
-    await init_beanie(database=client[DB_NAME], document_models=[UserProgress])
-    return client
+    """Initialize MongoDB with the same client settings as the API"""
+    await init_db()
+    return get_client()
+
+async def create_analytics_service() -> AnalyticsService:
+    """Build the worker's AnalyticsService on the loop its clients will run on"""
+    return AnalyticsService()
+
+async def close_analytics_service(analytics_service: AnalyticsService) -> None:
+    await analytics_service.aclose()
+    await analytics_service.redis_service.close()
+    await close_http_client()
+
+# Each worker process keeps one event loop, MongoDB client and AnalyticsService
+# for all of its tasks, so connections and pooled clients survive between tasks
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_mongo_client: Optional[AsyncIOMotorClient] = None
+_analytics_service: Optional[AnalyticsService] = None
+_loop_lock = threading.Lock()
+
+@worker_process_init.connect
+def init_worker_loop(**kwargs):
+    """Start the worker's event loop thread, connect to MongoDB and build the AnalyticsService"""
+    global _loop, _mongo_client, _analytics_service
+    with _loop_lock:
+        if _loop is not None:
+            return
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, name="async-worker-loop", daemon=True).start()
+        _mongo_client = asyncio.run_coroutine_threadsafe(init_mongodb(), loop).result()
+        _analytics_service = asyncio.run_coroutine_threadsafe(create_analytics_service(), loop).result()
+        _loop = loop
+
+@worker_process_shutdown.connect
+def shutdown_worker_loop(**kwargs):
+    """Close the worker's clients and stop its event loop"""
+    global _loop, _mongo_client, _analytics_service
+    with _loop_lock:
+        if _loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(close_analytics_service(_analytics_service), _loop).result()
+        close_db()
+        _loop.call_soon_threadsafe(_loop.stop)
+        _loop = None
+        _mongo_client = None
+        _analytics_service = None
 
 def setup_and_run_async(coro):
-    """Setup event loop, MongoDB, and run coroutine"""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    
-    async def wrapper():
-        # Initialize MongoDB connection
-        client = await init_mongodb()
-        try:
-            return await coro
-        finally:
-            client.close()
-    
-    try:
-        return loop.run_until_complete(wrapper())
-    finally:
-        loop.close()
-        asyncio.set_event_loop(None)
+    """Run a coroutine on the worker's event loop and wait for the result"""
+    if _loop is None:
+        # worker_process_init only fires for prefork pool children
+        init_worker_loop()
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result()
+
+def get_analytics_service() -> AnalyticsService:
+    """The worker's shared AnalyticsService; only valid on the worker loop
+
+    It lives as long as the worker process, and so does its GraphQL response
+    cache. sync_user_submissions fetches stats with use_cache=False, which
+    neither reads nor fills that cache, so tasks never accumulate entries in
+    it and what a sync persists is never served from it.
+    """
+    return _analytics_service
 
 
 
@@ -85,8 +145,8 @@ def sync_user_leetcode_data(self, user_id: str, csrf_token: str, cookie: str, us
     logger.debug(f"Starting sync task for user {user_id} with task_id: {self.request.id}", extra={"user_id": user_id})
     try:
         async def execute_sync():
+            analytics_service = get_analytics_service()
             try:
-                analytics_service = AnalyticsService()
                 logger.debug(f"Starting sync_user_submissions for user {user_id}", extra={"user_id": user_id})
                 result = await analytics_service.sync_user_submissions(
                     user_id=user_id,
@@ -103,11 +163,13 @@ def sync_user_leetcode_data(self, user_id: str, csrf_token: str, cookie: str, us
         # Execute the sync
         result = setup_and_run_async(execute_sync())
         logger.info(f"Successfully completed sync for user {user_id}")
+        publish_sync_event(user_id, self.request.id, {"status": "completed"})
         # Queue the stats update
         # update_user_statistics.delay(user_id)
         return {"status": "success", "user_id": user_id}
     except Exception as e:
         logger.error(f"Failed to sync user {user_id} data: {str(e)}", exc_info=True)
+        publish_sync_event(user_id, self.request.id, {"status": "failed", "error": str(e)})
         raise
 
 # @celery_app.task(bind=True, name='tasks.update_user_statistics')
@@ -190,23 +252,77 @@ def check_celery_status():
     logger.info("Celery health check task executed")
     return "OK"
 
-@celery_app.task
-async def periodic_sync_all_users():
-    try:
-        users = await UserProgress.find_all().to_list()
+@celery_app.task(name='tasks.periodic_sync_all_users')
+def periodic_sync_all_users():
+    """Sync every user that hasn't been updated in the last day"""
+    async def execute_periodic_sync():
+        # Let MongoDB apply the staleness filter and return only the ids,
+        # rather than loading every user's full progress document
+        cutoff = datetime.utcnow() - timedelta(hours=24)
+        cursor = UserProgress.get_motor_collection().find(
+            {"$or": [{"last_updated": None}, {"last_updated": {"$lt": cutoff}}]},
+            {"_id": 0, "user_id": 1}
+        )
+        stale_user_ids = [doc["user_id"] async for doc in cursor]
+        logger.info(f"Periodic sync found {len(stale_user_ids)} stale users")
+        
+        analytics_service = get_analytics_service()
+        sem = asyncio.Semaphore(PERIODIC_SYNC_CONCURRENCY)
+        
+        async def sync_one(user_id: str):
+            async with sem:
+                credentials = await get_user_credentials(user_id)
+                if not credentials:
+                    return None
+                # Collected per user so a failed write can be traced back to its user
+                write_ops = []
+                user_progress = await analytics_service.sync_user_submissions(
+                    user_id=user_id,
+                    csrf_token=credentials['csrf_token'],
+                    cookie=credentials['cookie'],
+                    username=credentials['username'],
+                    cache_stats=False,
+                    write_ops=write_ops
+                )
+                return user_id, user_progress.aggregated_stats, write_ops
+        
+        synced_count = 0
+        for start in range(0, len(stale_user_ids), STATS_CACHE_FLUSH_SIZE):
+            batch = stale_user_ids[start:start + STATS_CACHE_FLUSH_SIZE]
+            results = await asyncio.gather(
+                *(sync_one(user_id) for user_id in batch),
+                return_exceptions=True
+            )
+            
+            # This batch's MongoDB writes, sent together once it is synced
+            write_ops = {}
+            pending = []
+            for user_id, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Periodic sync failed for user {user_id}: {str(result)}", exc_info=result)
+                elif result is not None:
+                    _, stats, user_ops = result
+                    pending.append((user_id, stats))
+                    write_ops[user_id] = user_ops
+            
+            failed = await analytics_service.flush_many(write_ops)
+            # Only cache users whose progress actually reached MongoDB
+            synced = [(user_id, stats) for user_id, stats in pending if user_id not in failed]
+            if len(synced) < len(pending):
+                logger.error(f"Periodic sync batch at {start} failed to write {len(pending) - len(synced)} users")
+            if synced:
+                redis_service = analytics_service.redis_service
+                await redis_service.store_aggregated_stats_bulk(synced)
+                await redis_service.invalidate_calendar_heatmaps(user_id for user_id, _ in synced)
+            synced_count += len(synced)
+            logger.info(f"Periodic sync batch at {start} updated {len(synced)} users")
         
-        for user in users:
-            if (
-                not user.last_updated or 
-                datetime.utcnow() - user.last_updated > timedelta(hours=24)
-            ):
-                credentials = await get_user_credentials(user.user_id)
-                if credentials:
-                    await sync_user_leetcode_data.delay(
-                        user.user_id,
-                        credentials['csrf_token'],
-                        credentials['cookie']
-                    )
+        logger.info(f"Periodic sync updated {synced_count} users")
+        return synced_count
+    
+    try:
+        synced_count = setup_and_run_async(execute_periodic_sync())
+        return {"status": "success", "synced_users": synced_count}
     except Exception as e:
         logger.error(f"Failed to run periodic sync: {str(e)}")
         raise
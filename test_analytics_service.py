@@ -1,7 +1,7 @@
 # tests/services/test_analytics_service.py
 import pytest
-from datetime import datetime, timedelta
-from unittest.mock import Mock, patch, AsyncMock
+from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock, MagicMock, patch, AsyncMock, call
 from models import (
     UserProgress, 
     Question, 
@@ -194,6 +194,261 @@ async def test_sync_with_existing_data(mock_leetcode_service, mongodb):
     assert "1" in question_ids  # Existing question
     assert "2" in question_ids  # New question
 
+@pytest.mark.asyncio
+async def test_sync_persists_only_changed_questions(mock_leetcode_service, mock_graphql_service, mongodb):
+    """Test that an incremental sync writes new and updated questions to MongoDB"""
+    # Arrange
+    current_time = int(datetime.now().timestamp())
+    
+    existing_progress = UserProgress(
+        user_id="test_user",
+        progress_data=ProgressData(
+            leetcode=PlatformProgress(
+                questions=[
+                    Question(
+                        id="1",
+                        name="Two Sum",
+                        status="attempted",
+                        last_attempted=datetime.fromtimestamp(current_time - 7200)
+                    )
+                ]
+            ),
+            geeksforgeeks=None
+        ),
+        aggregated_stats=AggregatedStats()
+    )
+    await existing_progress.save()
+
+    mock_submissions = [
+        MockLeetCodeSubmission(
+            id=3,
+            question_id=2,
+            title="Add Two Numbers",
+            status_display="Accepted",
+            timestamp=current_time
+        ),
+        MockLeetCodeSubmission(
+            id=2,
+            question_id=1,
+            title="Two Sum",
+            status_display="Accepted",
+            timestamp=current_time - 60
+        )
+    ]
+    
+    mock_leetcode_service.fetch_all_submissions.return_value = mock_submissions
+    mock_graphql_service.fetch_all_stats.return_value = (None, None, None, None, None)
+    
+    from leetcode_service import AnalyticsService
+    analytics_service = AnalyticsService()
+    analytics_service.leetcode_service = mock_leetcode_service
+    analytics_service.graphql_service = mock_graphql_service
+
+    # Act
+    await analytics_service.sync_user_submissions(
+        user_id="test_user",
+        username="test",
+        csrf_token="token",
+        cookie="cookie"
+    )
+
+    # Assert
+    stored = await UserProgress.find_one({"user_id": "test_user"})
+    questions = stored.progress_data.leetcode.questions
+    assert [q.id for q in questions] == ["2", "1"]
+    assert all(q.status == "solved" for q in questions)
+
+@pytest.mark.asyncio
+async def test_incremental_syncs_track_total_solved(mock_leetcode_service, mock_graphql_service, mongodb):
+    """Test that repeated syncs adjust total_solved by their delta and patch stored questions"""
+    # Arrange
+    current_time = int(datetime.now().timestamp())
+    mock_graphql_service.fetch_all_stats.return_value = (None, None, None, None, None)
+
+    from leetcode_service import AnalyticsService
+    analytics_service = AnalyticsService()
+    analytics_service.leetcode_service = mock_leetcode_service
+    analytics_service.graphql_service = mock_graphql_service
+
+    async def sync(submissions):
+        mock_leetcode_service.fetch_all_submissions.return_value = submissions
+        await analytics_service.sync_user_submissions(
+            user_id="test_user",
+            username="test",
+            csrf_token="token",
+            cookie="cookie"
+        )
+        return await UserProgress.find_one({"user_id": "test_user"})
+
+    # Act
+    first = await sync([
+        MockLeetCodeSubmission(id=2, question_id=2, title="Add Two Numbers",
+                               status_display="Accepted", timestamp=current_time),
+        MockLeetCodeSubmission(id=1, question_id=1, title="Two Sum",
+                               status_display="Wrong Answer", timestamp=current_time - 60)
+    ])
+    second = await sync([
+        MockLeetCodeSubmission(id=5, question_id=3, title="Longest Substring",
+                               status_display="Accepted", timestamp=current_time + 120),
+        MockLeetCodeSubmission(id=4, question_id=1, title="Two Sum",
+                               status_display="Accepted", timestamp=current_time + 60),
+        MockLeetCodeSubmission(id=3, question_id=2, title="Add Two Numbers",
+                               status_display="Wrong Answer", timestamp=current_time + 30)
+    ])
+
+    # Assert
+    assert first.aggregated_stats.total_solved == 1
+    assert [q.id for q in first.progress_data.leetcode.questions] == ["2", "1"]
+
+    # +1 for question 3, +1 for question 1, -1 for question 2
+    assert second.aggregated_stats.total_solved == 2
+    questions = {q.id: q for q in second.progress_data.leetcode.questions}
+    assert [q.id for q in second.progress_data.leetcode.questions] == ["3", "2", "1"]
+    assert questions["1"].status == "solved"
+    assert questions["1"].last_attempted == current_time + 60
+    assert questions["2"].status == "attempted"
+    assert questions["2"].last_attempted == current_time + 30
+    assert questions["3"].status == "solved"
+
+@pytest.mark.asyncio
+async def test_full_recount_recomputes_total_solved(mock_leetcode_service, mock_graphql_service, mongodb):
+    """Test that full_recount counts solved questions instead of applying a delta"""
+    # Arrange
+    current_time = int(datetime.now().timestamp())
+
+    existing_progress = UserProgress(
+        user_id="test_user",
+        progress_data=ProgressData(
+            leetcode=PlatformProgress(
+                questions=[
+                    Question(id="2", name="Add Two Numbers", status="attempted",
+                             last_attempted=current_time - 60),
+                    Question(id="1", name="Two Sum", status="solved",
+                             last_attempted=current_time - 120)
+                ]
+            ),
+            geeksforgeeks=None
+        ),
+        # A drifted total that an incremental sync would carry forward
+        aggregated_stats=AggregatedStats(total_solved=99)
+    )
+    await existing_progress.save()
+
+    mock_leetcode_service.fetch_all_submissions.return_value = [
+        MockLeetCodeSubmission(id=3, question_id=3, title="Longest Substring",
+                               status_display="Accepted", timestamp=current_time)
+    ]
+    mock_graphql_service.fetch_all_stats.return_value = (None, None, None, None, None)
+
+    from leetcode_service import AnalyticsService
+    analytics_service = AnalyticsService()
+    analytics_service.leetcode_service = mock_leetcode_service
+    analytics_service.graphql_service = mock_graphql_service
+
+    # Act
+    await analytics_service.sync_user_submissions(
+        user_id="test_user",
+        username="test",
+        csrf_token="token",
+        cookie="cookie",
+        full_recount=True
+    )
+
+    # Assert
+    stored = await UserProgress.find_one({"user_id": "test_user"})
+    assert stored.aggregated_stats.total_solved == 2
+    assert [q.id for q in stored.progress_data.leetcode.questions] == ["3", "2", "1"]
+
+@pytest.mark.asyncio
+async def test_repeated_sync_does_not_duplicate_questions(mock_leetcode_service, mock_graphql_service, mongodb):
+    """Test that writing the same new questions twice leaves a single copy of each"""
+    # Arrange
+    current_time = int(datetime.now().timestamp())
+
+    existing_progress = UserProgress(
+        user_id="test_user",
+        progress_data=ProgressData(
+            leetcode=PlatformProgress(
+                questions=[
+                    Question(id="1", name="Two Sum", status="solved",
+                             last_attempted=current_time - 120)
+                ]
+            ),
+            geeksforgeeks=None
+        ),
+        aggregated_stats=AggregatedStats(total_solved=1)
+    )
+    await existing_progress.save()
+
+    mock_leetcode_service.fetch_all_submissions.return_value = [
+        MockLeetCodeSubmission(id=2, question_id=2, title="Add Two Numbers",
+                               status_display="Accepted", timestamp=current_time)
+    ]
+    mock_graphql_service.fetch_all_stats.return_value = (None, None, None, None, None)
+
+    from leetcode_service import AnalyticsService
+    analytics_service = AnalyticsService()
+    graphql_service = analytics_service.graphql_service
+    analytics_service.leetcode_service = mock_leetcode_service
+    analytics_service.graphql_service = mock_graphql_service
+
+    # Act: two overlapping syncs both read the document before either writes
+    write_ops = [[], []]
+    try:
+        for ops in write_ops:
+            await analytics_service.sync_user_submissions(
+                user_id="test_user",
+                username="test",
+                csrf_token="token",
+                cookie="cookie",
+                cache_stats=False,
+                write_ops=ops
+            )
+        for ops in write_ops:
+            await analytics_service.flush_many({"test_user": ops})
+    finally:
+        await graphql_service.aclose()
+
+    # Assert
+    stored = await UserProgress.find_one({"user_id": "test_user"})
+    assert [q.id for q in stored.progress_data.leetcode.questions] == ["2", "1"]
+    assert stored.aggregated_stats.total_solved == 2
+
+
+@pytest.mark.asyncio
+async def test_flush_many_reports_users_with_failed_writes():
+    """Test that failed bulk write indexes are traced back to the users that own them"""
+    from bson import ObjectId
+    from pymongo import UpdateOne
+    from pymongo.errors import BulkWriteError
+    from leetcode_service import AnalyticsService
+
+    user_ops = {
+        "user_a": [UpdateOne({"_id": ObjectId()}, {"$set": {"last_updated": datetime.utcnow()}})],
+        "user_b": [
+            UpdateOne({"_id": ObjectId()}, {"$set": {"last_updated": datetime.utcnow()}}),
+            UpdateOne({"_id": ObjectId()}, {"$set": {"last_updated": datetime.utcnow()}})
+        ],
+        "user_c": [UpdateOne({"_id": ObjectId()}, {"$set": {"last_updated": datetime.utcnow()}})]
+    }
+    collection = Mock()
+    collection.bulk_write = AsyncMock(side_effect=BulkWriteError({
+        "writeErrors": [
+            {"index": 2, "code": 11000, "errmsg": "duplicate key", "op": {"_id": ObjectId()}},
+            {"index": 3, "code": 121, "errmsg": "validation failed", "op": {"_id": ObjectId()}}
+        ]
+    }))
+
+    analytics_service = AnalyticsService()
+    try:
+        with patch.object(UserProgress, "get_motor_collection", return_value=collection):
+            failed = await analytics_service.flush_many(user_ops)
+    finally:
+        await analytics_service.aclose()
+
+    assert failed == {"user_b", "user_c"}
+    assert collection.bulk_write.await_args.args[0] == [op for ops in user_ops.values() for op in ops]
+
 @pytest.mark.asyncio
 async def test_sync_with_different_submission_status(mock_leetcode_service, mongodb):
     """Test sync with different submission statuses"""
@@ -247,6 +502,31 @@ async def test_sync_with_different_submission_status(mock_leetcode_service, mong
     assert len(solved) == 1
     assert len(attempted) == 2
 
+@pytest.mark.asyncio
+async def test_calculate_submission_intensity():
+    """Test intensity buckets at their boundaries"""
+    from leetcode_service import AnalyticsService
+    analytics_service = AnalyticsService()
+
+    try:
+        expected = {0: 0, 1: 1, 3: 1, 4: 2, 6: 2, 7: 3, 10: 3, 11: 4, 100: 4}
+        for count, intensity in expected.items():
+            assert analytics_service.calculate_submission_intensity(count) == intensity
+    finally:
+        await analytics_service.aclose()
+
+def test_question_last_attempted_from_datetime():
+    """Test that stored datetimes are read back as epoch seconds"""
+    question = Question(
+        id="1",
+        name="Two Sum",
+        status="solved",
+        last_attempted=datetime(2024, 1, 1)
+    )
+
+    assert question.last_attempted == 1704067200
+    assert question.model_dump(mode="json")["last_attempted"] == "2024-01-01T00:00:00Z"
+
 @pytest.mark.asyncio
 async def test_error_handling(mock_leetcode_service, mongodb):
     """Test error handling"""
@@ -265,4 +545,355 @@ async def test_error_handling(mock_leetcode_service, mongodb):
             csrf_token="token",
             cookie="cookie"
         )
-    assert str(exc_info.value) == "API Error"
\ No newline at end of file
+    assert str(exc_info.value) == "API Error"
+
+
+@pytest.mark.asyncio
+async def test_fetch_all_stats_splits_batched_response():
+    """Test that the batched stats response is split into the per-query shapes"""
+    from leetcode_graphql import LeetCodeGraphQLService
+    graphql_service = LeetCodeGraphQLService()
+    graphql_service._make_graphql_request = AsyncMock(return_value={
+        "allQuestionsCount": [{"difficulty": "All", "count": 3000}],
+        "matchedUser": {
+            "tagProblemCounts": {"advanced": [], "intermediate": [], "fundamental": []},
+            "languageProblemCount": [{"languageName": "Python3", "problemsSolved": 42}],
+            "problemsSolvedBeatsStats": [{"difficulty": "Easy", "percentage": 76.4}],
+            "submitStatsGlobal": {"acSubmissionNum": [{"difficulty": "All", "count": 42}]},
+            "userCalendar": {"streak": 3, "totalActiveDays": 10},
+            "activeBadge": {"displayName": "Annual Badge", "icon": "badge.png"}
+        }
+    })
+
+    try:
+        tag_stats, language_stats, problem_stats, calendar, badge = (
+            await graphql_service.fetch_all_stats("test", "token", "cookie")
+        )
+    finally:
+        await graphql_service.aclose()
+
+    assert tag_stats == {"advanced": [], "intermediate": [], "fundamental": []}
+    assert language_stats == [{"languageName": "Python3", "problemsSolved": 42}]
+    assert problem_stats == {
+        "allQuestionsCount": [{"difficulty": "All", "count": 3000}],
+        "matchedUser": {
+            "problemsSolvedBeatsStats": [{"difficulty": "Easy", "percentage": 76.4}],
+            "submitStatsGlobal": {"acSubmissionNum": [{"difficulty": "All", "count": 42}]}
+        }
+    }
+    assert calendar == {"streak": 3, "totalActiveDays": 10}
+    assert badge == {"displayName": "Annual Badge", "icon": "badge.png"}
+
+@pytest.mark.asyncio
+async def test_fetch_all_stats_without_matched_user():
+    """Test that an unknown user yields empty stats rather than failing"""
+    from leetcode_graphql import LeetCodeGraphQLService
+    graphql_service = LeetCodeGraphQLService()
+    graphql_service._make_graphql_request = AsyncMock(return_value={
+        "allQuestionsCount": [],
+        "matchedUser": None
+    })
+
+    try:
+        tag_stats, language_stats, problem_stats, calendar, badge = (
+            await graphql_service.fetch_all_stats("missing", "token", "cookie")
+        )
+    finally:
+        await graphql_service.aclose()
+
+    assert tag_stats == {}
+    assert language_stats == []
+    assert problem_stats["matchedUser"] == {
+        "problemsSolvedBeatsStats": [],
+        "submitStatsGlobal": {}
+    }
+    assert calendar == {}
+    assert badge is None
+
+@pytest.mark.asyncio
+async def test_fetch_all_stats_request_failure():
+    """Test that a failed batched request yields five Nones"""
+    from leetcode_graphql import LeetCodeGraphQLService
+    graphql_service = LeetCodeGraphQLService()
+    graphql_service._make_graphql_request = AsyncMock(return_value=None)
+
+    try:
+        result = await graphql_service.fetch_all_stats("test", "token", "cookie")
+    finally:
+        await graphql_service.aclose()
+
+    assert result == (None, None, None, None, None)
+
+def _submission_dump(question_id: int, timestamp: int, status_display: str = "Accepted") -> dict:
+    """A raw submission as returned by LeetCode's submissions API"""
+    return {
+        "id": question_id * 100 + timestamp % 100,
+        "question_id": question_id,
+        "title": f"Question {question_id}",
+        "title_slug": f"question-{question_id}",
+        "status_display": status_display,
+        "timestamp": timestamp,
+        "runtime": "100 ms",
+        "memory": "10 MB",
+        "lang": "python3"
+    }
+
+def _mock_submission_pages(leetcode_service, pages):
+    """Serve pages by offset from _fetch_submissions_page, recording the offsets requested"""
+    requested = []
+
+    async def fetch_page(headers, offset):
+        requested.append(offset)
+        page = pages.get(offset, {"submissions_dump": [], "has_next": False})
+        if isinstance(page, Exception):
+            raise page
+        return page
+
+    leetcode_service._fetch_submissions_page = fetch_page
+    return requested
+
+def _full_page(offset: int, newest: int = 1_700_000_000) -> dict:
+    """A full page of unique questions, newest first"""
+    from leetcode_service import SUBMISSIONS_PAGE_SIZE
+    return {
+        "submissions_dump": [
+            _submission_dump(offset + i, newest - offset - i)
+            for i in range(SUBMISSIONS_PAGE_SIZE)
+        ],
+        "has_next": True
+    }
+
+@pytest.mark.asyncio
+async def test_fetch_all_submissions_single_page():
+    """Test that a first page without has_next ends pagination"""
+    leetcode_service = LeetCodeService()
+    requested = _mock_submission_pages(leetcode_service, {
+        0: {"submissions_dump": [_submission_dump(1, 1_700_000_000)], "has_next": False}
+    })
+
+    submissions = await leetcode_service.fetch_all_submissions("token", "cookie")
+
+    assert requested == [0]
+    assert [s.question_id for s in submissions] == [1]
+
+@pytest.mark.asyncio
+async def test_fetch_all_submissions_stops_on_short_page():
+    """Test that a short page ends pagination even when has_next is set"""
+    leetcode_service = LeetCodeService()
+    short_page = _full_page(20)
+    short_page["submissions_dump"] = short_page["submissions_dump"][:5]
+    requested = _mock_submission_pages(leetcode_service, {
+        0: _full_page(0),
+        20: short_page,
+        40: _full_page(40)
+    })
+
+    submissions = await leetcode_service.fetch_all_submissions("token", "cookie")
+
+    # The first page is fetched alone, then one prefetched batch and no more
+    assert requested[0] == 0
+    assert max(requested) == 100
+    assert len(submissions) == 25
+    assert 40 not in {s.question_id for s in submissions}
+
+@pytest.mark.asyncio
+async def test_fetch_all_submissions_keeps_pages_before_failure():
+    """Test that a failed page in a batch keeps the pages before it and stops"""
+    leetcode_service = LeetCodeService()
+    requested = _mock_submission_pages(leetcode_service, {
+        0: _full_page(0),
+        20: _full_page(20),
+        40: Exception("API Error"),
+        60: _full_page(60)
+    })
+
+    submissions = await leetcode_service.fetch_all_submissions("token", "cookie")
+
+    assert max(requested) == 100
+    question_ids = {s.question_id for s in submissions}
+    assert question_ids == set(range(40))
+
+@pytest.mark.asyncio
+async def test_fetch_all_submissions_deduplicates_across_pages():
+    """Test that only the newest submission of a question is kept across pages"""
+    leetcode_service = LeetCodeService()
+    first_page = _full_page(0)
+    second_page = _full_page(20)
+    # An older, failed attempt at question 0 appears on the second page
+    second_page["submissions_dump"][0] = _submission_dump(0, 1_600_000_000, "Wrong Answer")
+    second_page["has_next"] = False
+    _mock_submission_pages(leetcode_service, {0: first_page, 20: second_page})
+
+    submissions = await leetcode_service.fetch_all_submissions("token", "cookie")
+
+    by_question = {s.question_id: s for s in submissions}
+    assert len(submissions) == len(by_question) == 39
+    assert by_question[0].status_display == "Accepted"
+    assert by_question[0].timestamp == 1_700_000_000
+
+@pytest.mark.asyncio
+async def test_fetch_all_submissions_stops_at_last_sync():
+    """Test that pagination stops at the first submission seen by the last sync"""
+    leetcode_service = LeetCodeService()
+    requested = _mock_submission_pages(leetcode_service, {
+        0: _full_page(0),
+        20: _full_page(20)
+    })
+
+    # Submissions on the first page are 1_700_000_000 - i; keep the newest five
+    submissions = await leetcode_service.fetch_all_submissions(
+        "token",
+        "cookie",
+        last_sync_epoch=1_700_000_000 - 5
+    )
+
+    assert requested == [0]
+    assert [s.question_id for s in submissions] == [0, 1, 2, 3, 4]
+
+@pytest.mark.asyncio
+async def test_graphql_cache_bypass_and_key():
+    """Test that use_cache=False bypasses the cache and that every variable is part of the key"""
+    from leetcode_graphql import LeetCodeGraphQLService
+    graphql_service = LeetCodeGraphQLService()
+    graphql_service._make_graphql_request = AsyncMock(return_value={"matchedUser": {}})
+    headers = graphql_service._build_headers("token", "cookie")
+
+    try:
+        variables = {"username": "test", "year": 2024}
+        await graphql_service._cached_graphql_request("calendar", "query", variables, headers)
+        await graphql_service._cached_graphql_request("calendar", "query", variables, headers)
+        assert graphql_service._make_graphql_request.await_count == 1
+
+        await graphql_service._cached_graphql_request("calendar", "query", variables, headers, use_cache=False)
+        assert graphql_service._make_graphql_request.await_count == 2
+
+        # A bypassed response is not stored for later readers
+        bypassed = {"username": "other", "year": 2024}
+        await graphql_service._cached_graphql_request("calendar", "query", bypassed, headers, use_cache=False)
+        assert graphql_service._make_graphql_request.await_count == 3
+        assert len(graphql_service._cache) == 1
+        graphql_service._make_graphql_request.reset_mock()
+
+        await graphql_service._cached_graphql_request(
+            "calendar", "query", {"username": "test", "year": 2023}, headers
+        )
+        await graphql_service._cached_graphql_request(
+            "calendar", "query", variables, graphql_service._build_headers("other", "cookie")
+        )
+        assert graphql_service._make_graphql_request.await_count == 2
+    finally:
+        await graphql_service.aclose()
+
+def _mock_redis_service(stored_digest, execute_results):
+    """RedisService backed by a mock client whose pipelines record their commands"""
+    from redis_service import RedisService
+    pipe = Mock()
+    pipe.execute = AsyncMock(side_effect=execute_results)
+    pipeline = MagicMock()
+    pipeline.__aenter__.return_value = pipe
+    redis = Mock()
+    redis.get = AsyncMock(return_value=stored_digest)
+    redis.pipeline = Mock(return_value=pipeline)
+
+    redis_service = RedisService("redis://localhost:6379/0")
+    redis_service._redis = redis
+    return redis_service, pipe
+
+@pytest.mark.asyncio
+async def test_store_aggregated_stats_unchanged_refreshes_ttl():
+    """Test that an unchanged payload only pushes back the expiry of both keys"""
+    from redis_service import STATS_CACHE_TTL, _stats_digest
+    stats = AggregatedStats(total_solved=3)
+    payload = stats.model_dump_json().encode()
+    redis_service, pipe = _mock_redis_service(_stats_digest(payload), [[True, True]])
+
+    assert await redis_service.store_aggregated_stats("test_user", stats) == payload
+    assert pipe.expire.call_args_list == [
+        call("user:stats:test_user", STATS_CACHE_TTL),
+        call("user:stats:h:test_user", STATS_CACHE_TTL)
+    ]
+    pipe.set.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_store_aggregated_stats_changed_rewrites_both_keys():
+    """Test that a changed payload rewrites the stats and its digest"""
+    from redis_service import STATS_CACHE_TTL, _stats_digest
+    stats = AggregatedStats(total_solved=4)
+    payload = stats.model_dump_json().encode()
+    stale_digest = _stats_digest(AggregatedStats(total_solved=3).model_dump_json().encode())
+    redis_service, pipe = _mock_redis_service(stale_digest, [[True, True]])
+
+    assert await redis_service.store_aggregated_stats("test_user", stats) == payload
+    pipe.expire.assert_not_called()
+    assert pipe.set.call_args_list == [
+        call("user:stats:test_user", payload, ex=STATS_CACHE_TTL),
+        call("user:stats:h:test_user", _stats_digest(payload), ex=STATS_CACHE_TTL)
+    ]
+
+@pytest.mark.asyncio
+async def test_store_aggregated_stats_rewrites_expired_payload():
+    """Test that a matching digest whose stats key already expired still rewrites both keys"""
+    from redis_service import STATS_CACHE_TTL, _stats_digest
+    stats = AggregatedStats(total_solved=3)
+    payload = stats.model_dump_json().encode()
+    redis_service, pipe = _mock_redis_service(_stats_digest(payload), [[False, True], [True, True]])
+
+    assert await redis_service.store_aggregated_stats("test_user", stats) == payload
+    assert pipe.expire.call_count == 2
+    assert pipe.set.call_args_list == [
+        call("user:stats:test_user", payload, ex=STATS_CACHE_TTL),
+        call("user:stats:h:test_user", _stats_digest(payload), ex=STATS_CACHE_TTL)
+    ]
+
+def _calendar_payload(days, streak: int = 0) -> dict:
+    """Calendar response with one submission on each of the given UTC dates"""
+    import orjson
+    submission_calendar = {
+        str(int(datetime(*day, tzinfo=timezone.utc).timestamp())): 1
+        for day in days
+    }
+    return {
+        "activeYears": [2024],
+        "totalActiveDays": len(days),
+        "streak": streak,
+        "submissionCalendar": orjson.dumps(submission_calendar).decode()
+    }
+
+def test_longest_streak():
+    """Test the longest run of consecutive days"""
+    from leetcode_graphql import LeetCodeGraphQLService
+    assert LeetCodeGraphQLService._longest_streak([]) == 0
+    assert LeetCodeGraphQLService._longest_streak([5]) == 1
+    # Unsorted, with gaps between the runs
+    assert LeetCodeGraphQLService._longest_streak([12, 1, 2, 10, 3, 11, 13, 14, 7]) == 5
+
+@pytest.mark.asyncio
+async def test_process_calendar_data_streaks():
+    """Test longest streak across gaps, month boundaries and LeetCode's own streak"""
+    from leetcode_graphql import LeetCodeGraphQLService
+    from models import CalendarStats
+    graphql_service = LeetCodeGraphQLService()
+
+    try:
+        assert graphql_service.process_calendar_data({}) == CalendarStats()
+
+        gaps = graphql_service.process_calendar_data(
+            _calendar_payload([(2024, 3, 1), (2024, 3, 2), (2024, 3, 5), (2024, 3, 7), (2024, 3, 8), (2024, 3, 9)])
+        )
+        assert gaps.streaks.longest == 3
+
+        month_boundary = graphql_service.process_calendar_data(
+            _calendar_payload([(2024, 1, 30), (2024, 1, 31), (2024, 2, 1), (2024, 2, 2)], streak=2)
+        )
+        assert month_boundary.streaks.longest == 4
+        assert month_boundary.streaks.current == 2
+        assert month_boundary.monthly_submissions == {"2024-01": 2, "2024-02": 2}
+
+        # The calendar may not reach back to the start of LeetCode's streak
+        reported = graphql_service.process_calendar_data(
+            _calendar_payload([(2024, 3, 1), (2024, 3, 2)], streak=10)
+        )
+        assert reported.streaks.longest == 10
+        assert reported.streaks.current == 10
+    finally:
+        await graphql_service.aclose()
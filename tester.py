@@ -1,15 +1,24 @@
 # logging_config.py
 import logging
-import json
+import orjson
 import sys
+import os
 from datetime import datetime
 from typing import Any, Dict
 
+# LogRecord attributes that are not extra fields
+_RESERVED_ATTRS = frozenset({
+    'msg', 'args', 'exc_info', 'exc_text', 'name', 'levelno', 'levelname',
+    'pathname', 'filename', 'module', 'lineno', 'funcName', 'created', 'msecs',
+    'relativeCreated', 'thread', 'threading', 'processName', 'process'
+})
+_BASE_ENTRY = {'service': 'analytics'}
+
 class JSONFormatter(logging.Formatter):
     def format(self, record: logging.LogRecord) -> str:
         log_entry = {
-            '@timestamp': datetime.utcnow().isoformat(),
-            'service': 'analytics',
+            '@timestamp': datetime.utcfromtimestamp(record.created).isoformat(),
+            **_BASE_ENTRY,
             'level': record.levelname,
             'message': record.getMessage(),
             'logger_name': record.name,
@@ -20,28 +29,23 @@ class JSONFormatter(logging.Formatter):
         }
         
         # Add extra fields if they exist
-        print(record.__dict__, "hereee")
         # if hasattr(record, 'extra'):
         #     log_entry.update(record.extra)
-        extra_fields = {
+        log_entry.update({
             key: value
             for key, value in record.__dict__.items()
-            if not (key.startswith('_') or key in ['msg', 'args', 'exc_info', 'exc_text', 'name', 
-                   'levelno', 'levelname', 'pathname', 'filename', 'module', 'lineno', 
-                   'funcName', 'created', 'msecs', 'relativeCreated', 'thread', 'threading',
-                   'processName', 'process'])
-        }
-        log_entry.update(extra_fields)
+            if key[0] != '_' and key not in _RESERVED_ATTRS
+        })
             
         # Add exception info if present
         if record.exc_info:
             log_entry['exception'] = self.formatException(record.exc_info)
             
-        return json.dumps(log_entry)
+        return orjson.dumps(log_entry).decode()
 
 def setup_logging():
     logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)
+    logger.setLevel(os.getenv('LOG_LEVEL', 'DEBUG').upper())
     
     # Console handler with JSON formatting
     handler = logging.StreamHandler(sys.stdout)